@@ -0,0 +1,19 @@
+import pytest
+
+from server.workers import redis_workers
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    """
+    In-memory Redis swapped in for the workers' shared client
+    Skips the test unless the packages in requirements-dev.txt are installed
+    """
+    pytest.importorskip("pytest_asyncio", reason="worker tests need requirements-dev.txt")
+    fakeredis = pytest.importorskip("fakeredis", reason="worker tests need requirements-dev.txt")
+    pytest.importorskip("lupa", reason="fakeredis needs lupa to run the worker scripts")
+
+    # A server of its own, so every test starts empty
+    client = fakeredis.FakeAsyncRedis(server=fakeredis.FakeServer(), decode_responses=False)
+    monkeypatch.setattr(redis_workers.redis_client, "client", client)
+    return client
@@ -9,10 +9,16 @@ from uuid import uuid4
 import json
 import time
 from datetime import datetime
+from dataclasses import asdict
 
-from .models.routing_state_machine import Message, MessageState, transition, process_message
+from .models.routing_state_machine import (
+    Message, MessageState, transition, process_message, enable_queued_transition_logging
+)
 from .channels.adapters import channel_manager, SendResult
-from .utils.contact_manager import contact_manager, get_contact_for_sending, record_message_sent, is_contact_opted_in
+from .utils.contact_manager import (
+    get_contact_manager, get_contact_for_sending, get_contact_hint_for_sending, record_message_sent,
+    is_contact_opted_in, ContactHint
+)
 from .llm import enhance_with_llm, ChannelType, DraftResult, validate_message, sanitize_message
 from .workers.redis_workers import enqueue_message
 from .config import get_config, init_config
@@ -23,6 +29,7 @@ config = get_config()
 # Configure logging
 logging.basicConfig(level=getattr(logging, config.log_level.upper()))
 logger = logging.getLogger(__name__)
+transition_log_listener = enable_queued_transition_logging()
 
 app = FastAPI(
     title="LLM-Powered Free SMS/RCS/Email Service",
@@ -79,6 +86,11 @@ async def general_exception_handler(request: Request, exc: Exception):
         }
     )
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush queued log records on shutdown"""
+    transition_log_listener.stop()
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize components on startup"""
@@ -167,24 +179,18 @@ async def send_message(req: DraftRequest, background_tasks: BackgroundTasks):
     logger.info(f"Received send request: to={req.to}, channel={req.channel}")
 
     try:
-        # Get contact information
-        contact = get_contact_for_sending(req.to)
-
-        if not contact:
-            # Create a temporary contact if not found
-            contact = contact_manager.get_contact_by_phone(req.to)
-            if not contact:
-                # If still not found, create a minimal contact
-                contact = contact_manager.get_contact_by_email(req.to)
-                if not contact and req.email:
-                    # Create a temporary contact
-                    from .utils.contact_manager import Contact, ChannelPreference
-                    contact = Contact(
-                        id=str(uuid4()),
-                        name="Unknown",
-                        phone=req.to if '@' not in req.to else None,
-                        email=req.to if '@' in req.to else req.email
-                    )
+        # Get the contact's routing fields; the full record is only needed for LLM enhancement
+        contact = get_contact_hint_for_sending(req.to)
+
+        if not contact and req.email:
+            # Create a temporary contact
+            from .utils.contact_manager import Contact, ChannelPreference
+            contact = Contact(
+                id=str(uuid4()),
+                name="Unknown",
+                phone=req.to if '@' not in req.to else None,
+                email=req.to if '@' in req.to else req.email
+            )
 
         # Check if contact has opted in
         if contact and not is_contact_opted_in(contact):
@@ -201,14 +207,15 @@ async def send_message(req: DraftRequest, background_tasks: BackgroundTasks):
         if req.use_llm_enhancement and (req.intent or req.text):
             intent = req.intent or req.text
             channel_type = ChannelType(req.channel) if req.channel else ChannelType.SMS
+            recipient = get_contact_for_sending(req.to) if isinstance(contact, ContactHint) else contact
 
             llm_result: DraftResult = enhance_with_llm(
                 intent=intent,
                 channel=channel_type,
                 recipient_info={
-                    "name": contact.name if contact else None,
-                    "relationship": contact.tags[0] if contact and contact.tags else "unknown"
-                } if contact else None
+                    "name": recipient.name,
+                    "relationship": recipient.tags[0] if recipient.tags else "unknown"
+                } if recipient else None
             )
 
             if llm_result.success:
@@ -224,7 +231,7 @@ async def send_message(req: DraftRequest, background_tasks: BackgroundTasks):
         channel_to_use = req.channel
         if not channel_to_use:
             if contact:
-                channel_to_use = contact_manager.get_preferred_channel(contact).value
+                channel_to_use = get_contact_manager().get_preferred_channel(contact).value
             else:
                 # Default to SMS if no contact info
                 channel_to_use = "sms"
@@ -232,7 +239,7 @@ async def send_message(req: DraftRequest, background_tasks: BackgroundTasks):
         # Get fallback channels
         fallback_channels = req.fallback_channels
         if not fallback_channels and contact:
-            fallback_channels = [ch.value for ch in contact_manager.get_fallback_channels(contact)]
+            fallback_channels = [ch.value for ch in get_contact_manager().get_fallback_channels(contact)]
 
         # Validate the message
         validation = validate_message(text_to_send, ChannelType(channel_to_use))
@@ -371,7 +378,7 @@ async def health_check():
     redis_connected = True  # Placeholder - implement actual check
 
     # Check contact manager
-    contact_stats = contact_manager.get_contact_stats()
+    contact_stats = get_contact_manager().get_contact_stats()
 
     processing_time = time.time() - start_time
 
@@ -395,7 +402,7 @@ async def metrics():
     """Metrics endpoint for monitoring"""
     return {
         "android_connections": len(ANDROID_CLIENTS),
-        "contacts_total": contact_manager.get_contact_stats().get('total_contacts', 0),
+        "contacts_total": get_contact_manager().get_contact_stats().get('total_contacts', 0),
         "active_components": {
             "channel_adapters": len(channel_manager.adapters),
             "initialized": channel_manager.initialized
@@ -408,10 +415,10 @@ async def metrics():
 async def get_contacts(limit: Optional[int] = 100, offset: int = 0):
     """Get all contacts with pagination"""
     try:
-        contacts = contact_manager.get_all_contacts(limit=limit, offset=offset)
+        contacts = get_contact_manager().get_all_contacts(limit=limit, offset=offset)
         return {
             "success": True,
-            "contacts": [c.__dict__ for c in contacts],
+            "contacts": [asdict(c) for c in contacts],
             "total": len(contacts),
             "limit": limit,
             "offset": offset
@@ -424,10 +431,10 @@ async def get_contacts(limit: Optional[int] = 100, offset: int = 0):
 async def search_contacts(query: str):
     """Search contacts by name, phone, or email"""
     try:
-        contacts = contact_manager.search_contacts(query)
+        contacts = get_contact_manager().search_contacts(query)
         return {
             "success": True,
-            "contacts": [c.__dict__ for c in contacts],
+            "contacts": [asdict(c) for c in contacts],
             "total": len(contacts),
             "query": query
         }
@@ -439,9 +446,9 @@ async def search_contacts(query: str):
 async def get_contact_by_id(contact_id: str):
     """Get a specific contact by ID"""
     try:
-        contact = contact_manager.get_contact_by_id(contact_id)
+        contact = get_contact_manager().get_contact_by_id(contact_id)
         if contact:
-            return {"success": True, "contact": contact.__dict__}
+            return {"success": True, "contact": asdict(contact)}
         else:
             raise HTTPException(status_code=404, detail="Contact not found")
     except HTTPException:
@@ -469,7 +476,7 @@ async def add_contact(contact_data: dict):
             blocked=contact_data.get("blocked", False)
         )
 
-        success = contact_manager.add_contact(contact)
+        success = get_contact_manager().add_contact(contact)
         if success:
             return {"success": True, "contact_id": contact.id}
         else:
@@ -487,7 +494,7 @@ async def update_contact(contact_id: str, contact_data: dict):
         from .utils.contact_manager import Contact, ChannelPreference
 
         # Get existing contact to preserve unchanged fields
-        existing_contact = contact_manager.get_contact_by_id(contact_id)
+        existing_contact = get_contact_manager().get_contact_by_id(contact_id)
         if not existing_contact:
             raise HTTPException(status_code=404, detail="Contact not found")
 
@@ -505,7 +512,7 @@ async def update_contact(contact_id: str, contact_data: dict):
             blocked=contact_data.get("blocked", existing_contact.blocked)
         )
 
-        success = contact_manager.update_contact(updated_contact)
+        success = get_contact_manager().update_contact(updated_contact)
         if success:
             return {"success": True, "contact_id": contact_id}
         else:
@@ -518,7 +525,7 @@ async def update_contact(contact_id: str, contact_data: dict):
 async def delete_contact(contact_id: str):
     """Delete a contact"""
     try:
-        success = contact_manager.delete_contact(contact_id)
+        success = get_contact_manager().delete_contact(contact_id)
         if success:
             return {"success": True, "message": "Contact deleted successfully"}
         else:
@@ -1,23 +1,135 @@
-from enum import Enum
-from typing import Optional, List, Dict, Any
+from collections import deque
+from enum import IntEnum
+from typing import Optional, List, Dict, Any, Deque
+from logging.handlers import QueueHandler, QueueListener
+import queue
 import time
 import random
 import logging
 
+# Transition events are logged once per state change, so they get their own
+# logger that can be moved off the calling thread (see enable_queued_transition_logging)
+transition_logger = logging.getLogger(__name__ + ".transitions")
 
-class MessageState(str, Enum):
-    DRAFTED = "drafted"
-    ROUTING = "routing"
-    BLOCKED = "blocked"
-    QUEUED = "queued"
-    SENDING = "sending"
-    SENT = "sent"
-    CONFIRMED = "confirmed"
-    FAILED = "failed"
-    FALLBACK = "fallback"
+
+# Retry backoff bounds, in seconds
+RETRY_BASE_DELAY = 2.0
+RETRY_MAX_DELAY = 600.0
+
+# Bounds of the human-like pause before each send, in seconds
+HUMAN_DELAY_MIN = 1.2
+HUMAN_DELAY_MAX = 4.5
+
+
+class MessageState(IntEnum):
+    DRAFTED = 0
+    ROUTING = 1
+    BLOCKED = 2
+    QUEUED = 3
+    SENDING = 4
+    SENT = 5
+    CONFIRMED = 6
+    FAILED = 7
+    FALLBACK = 8
+
+    def __str__(self) -> str:
+        return _STATE_NAMES[self]
+
+    def __format__(self, format_spec: str) -> str:
+        return format(_STATE_NAMES[self], format_spec)
+
+
+# Wire/log names indexed by MessageState value
+_STATE_NAMES = (
+    "drafted",
+    "routing",
+    "blocked",
+    "queued",
+    "sending",
+    "sent",
+    "confirmed",
+    "failed",
+    "fallback",
+)
+_STATE_BY_NAME = {name: MessageState(i) for i, name in enumerate(_STATE_NAMES)}
+
+
+def state_name(state: MessageState) -> str:
+    """
+    Serialized name of a state (used at the Redis boundary)
+    """
+    return _STATE_NAMES[state]
+
+
+def parse_state(name: str) -> MessageState:
+    """
+    Parse a serialized state name back into a MessageState
+    Raises ValueError for unknown names
+    """
+    try:
+        return _STATE_BY_NAME[name]
+    except KeyError:
+        raise ValueError(f"{name!r} is not a valid MessageState") from None
+
+
+class SendError(IntEnum):
+    """Reason codes for failed sends, stored on the message instead of the error text"""
+    NETWORK_TIMEOUT = 1
+    PROVIDER_REJECTED = 2
+    AUTH_FAILED = 3
+    INVALID_CHANNEL = 4
+    UNKNOWN = 99
+
+
+class SendFailure(Exception):
+    """Base class for channel send errors that carry a SendError code"""
+    code = SendError.UNKNOWN
+
+
+class NetworkTimeout(SendFailure):
+    code = SendError.NETWORK_TIMEOUT
+
+
+class ProviderRejected(SendFailure):
+    code = SendError.PROVIDER_REJECTED
+
+
+class AuthFailed(SendFailure):
+    code = SendError.AUTH_FAILED
+
+
+class InvalidChannel(SendFailure, ValueError):
+    code = SendError.INVALID_CHANNEL
+
+
+# One example error text per code, for debugging
+error_samples: Dict[SendError, str] = {}
+
+
+def classify_error(exc: Exception) -> SendError:
+    """
+    Map an exception raised while sending to its SendError code
+    The first error text seen for each code is kept in error_samples
+    """
+    if isinstance(exc, SendFailure):
+        code = exc.code
+    elif isinstance(exc, (TimeoutError, ConnectionError)):
+        code = SendError.NETWORK_TIMEOUT
+    else:
+        code = SendError.UNKNOWN
+
+    if code not in error_samples:
+        error_samples[code] = str(exc)
+    return code
 
 
 class Message:
+    __slots__ = (
+        "id", "to", "text", "state", "channel", "attempts", "max_attempts",
+        "fallback_channels", "last_error_code", "created_at", "sent_at", "confirmed_at",
+        "priority", "expires_at", "retry_after", "metadata", "_preview",
+    )
+
     def __init__(self, id: str, to: str, text: str, channel: Optional[str] = None):
         self.id = id
         self.to = to
@@ -26,8 +138,8 @@ class Message:
         self.channel = channel
         self.attempts = 0
         self.max_attempts = 3
-        self.fallback_channels: List[str] = []
-        self.last_error: Optional[str] = None
+        self.fallback_channels: Deque[str] = deque()
+        self.last_error_code: Optional[SendError] = None
         self.created_at = time.time()
         self.sent_at: Optional[float] = None
         self.confirmed_at: Optional[float] = None
@@ -35,64 +147,117 @@ class Message:
         self.expires_at: Optional[float] = None  # Timestamp when message expires
         self.retry_after: Optional[float] = None  # Timestamp for next retry
         self.metadata: Dict[str, Any] = {}  # Additional metadata for the message
-
-
-def transition(msg: Message, event: str) -> bool:
+        self._preview = text if len(text) <= 50 else text[:50] + "..."  # Truncated text for send logs
+
+
+# State transition table, indexed by MessageState value
+_TRANSITION_TABLE: List[Dict[str, MessageState]] = [
+    # DRAFTED
+    {"route": MessageState.ROUTING},
+    # ROUTING
+    {"blocked": MessageState.BLOCKED, "ok": MessageState.QUEUED},
+    # BLOCKED - no transitions
+    {},
+    # QUEUED
+    {"send": MessageState.SENDING},
+    # SENDING
+    {"success": MessageState.SENT, "error": MessageState.FAILED},
+    # SENT
+    {"confirm": MessageState.CONFIRMED, "timeout": MessageState.CONFIRMED},  # timeout is optimistic
+    # CONFIRMED - no transitions
+    {},
+    # FAILED
+    {"retry": MessageState.QUEUED, "fallback": MessageState.FALLBACK},
+    # FALLBACK
+    {"reroute": MessageState.QUEUED},
+]
+
+
+# Timestamp attribute stamped when a message enters a state
+_ENTRY_TIMESTAMPS = {
+    MessageState.SENT: "sent_at",
+    MessageState.CONFIRMED: "confirmed_at",
+}
+
+
+def _build_transition(table: List[Dict[str, MessageState]]):
     """
+    Generate a specialized transition function from the transition table
+    The table is fixed at import time, so the generated code is a flat
+    if/elif over (state, event) pairs with direct attribute stores
+    """
+    namespace: Dict[str, Any] = {"__name__": __name__, "time": time, "logger": transition_logger}
+    lines = ["def transition(msg, event):", "    state = msg.state"]
+
+    state_kw = "if"
+    for state, edges in zip(MessageState, table):
+        if not edges:
+            continue
+        namespace[state.name] = state
+        lines.append(f"    {state_kw} state is {state.name}:")
+        state_kw = "elif"
+
+        event_kw = "if"
+        for event, target in edges.items():
+            namespace[target.name] = target
+            lines.append(f"        {event_kw} event == {event!r}:")
+            event_kw = "elif"
+            lines.append(f"            msg.state = {target.name}")
+            stamp = _ENTRY_TIMESTAMPS.get(target)
+            if stamp:
+                lines.append(f"            msg.{stamp} = time.time()")
+            lines.append(
+                "            logger.info(\"Message %s transitioned from %s to %s via event '%s'\", "
+                f"msg.id, state, {target.name}, event)"
+            )
+            lines.append("            return True")
+
+    lines.append(
+        "    logger.warning(\"No transition defined for state %s with event '%s' for message %s\", "
+        "state, event, msg.id)"
+    )
+    lines.append("    return False")
+
+    exec(compile("\n".join(lines), "<generated transition>", "exec"), namespace)
+    return namespace["transition"]
+
+
+transition = _build_transition(_TRANSITION_TABLE)
+transition.__doc__ = """
     State transition function for the message routing state machine
     Returns True if transition was successful, False otherwise
     """
-    # Define the state transition table
-    transition_table = {
-        MessageState.DRAFTED: {
-            "route": MessageState.ROUTING
-        },
-        MessageState.ROUTING: {
-            "blocked": MessageState.BLOCKED,
-            "ok": MessageState.QUEUED
-        },
-        MessageState.BLOCKED: {
-            # No transitions from blocked state
-        },
-        MessageState.QUEUED: {
-            "send": MessageState.SENDING
-        },
-        MessageState.SENDING: {
-            "success": MessageState.SENT,
-            "error": MessageState.FAILED
-        },
-        MessageState.SENT: {
-            "confirm": MessageState.CONFIRMED,
-            "timeout": MessageState.CONFIRMED  # optimistic
-        },
-        MessageState.CONFIRMED: {
-            # No transitions from confirmed state
-        },
-        MessageState.FAILED: {
-            "retry": MessageState.QUEUED,
-            "fallback": MessageState.FALLBACK
-        },
-        MessageState.FALLBACK: {
-            "reroute": MessageState.QUEUED
-        }
-    }
-
-    # Check if the transition is valid
-    if msg.state in transition_table and event in transition_table[msg.state]:
-        old_state = msg.state
-        msg.state = transition_table[msg.state][event]
-
-        # Update timestamps based on state
-        if msg.state == MessageState.SENT:
-            msg.sent_at = time.time()
-        elif msg.state == MessageState.CONFIRMED:
-            msg.confirmed_at = time.time()
-
-        logging.info(f"Message {msg.id} transitioned from {old_state} to {msg.state} via event '{event}'")
-        return True
-    else:
-        logging.warning(f"No transition defined for state {msg.state} with event '{event}' for message {msg.id}")
-        return False
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler that leaves formatting to the listener thread and drops
+    records instead of blocking or erroring when the queue is full
+    """
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+def enable_queued_transition_logging(maxsize: int = 100_000) -> QueueListener:
+    """
+    Hand transition log records to a background thread
+    The calling thread only does a non-blocking queue put; a QueueListener
+    thread owns the root logger's handlers and does the formatting and I/O.
+    Call once logging is configured, and stop the returned listener on shutdown
+    """
+    log_queue = queue.Queue(maxsize=maxsize)
+    listener = QueueListener(log_queue, *logging.getLogger().handlers, respect_handler_level=True)
+    transition_logger.addHandler(_DeferredQueueHandler(log_queue))
+    transition_logger.propagate = False
+    listener.start()
+    return listener
 
 
 def choose_channel(contact) -> Optional[str]:
@@ -128,36 +293,29 @@ def process_message(msg: Message, contact) -> bool:
     Main processing loop for a message
     Returns True if processing should continue, False if blocked
     """
-    try:
-        # Transition to routing state
-        transition(msg, "route")
-
-        # Choose the best channel for the contact
-        channel = choose_channel(contact)
-        if channel is None:
-            logging.error(f"No suitable channel found for message {msg.id}")
-            transition(msg, "blocked")
-            return False
-
-        msg.channel = channel
-
-        # Check if the message should be blocked
-        if is_blocked(contact, msg):
-            logging.info(f"Message {msg.id} blocked by safety filters")
-            transition(msg, "blocked")
-            return False
+    # Transition to routing state
+    transition(msg, "route")
+
+    # Choose the best channel for the contact
+    channel = choose_channel(contact)
+    if channel is None:
+        logging.error(f"No suitable channel found for message {msg.id}")
+        transition(msg, "blocked")
+        return False
 
-        # Transition to queued state
-        transition(msg, "ok")
-        logging.info(f"Message {msg.id} processed successfully, channel: {msg.channel}")
-        return True
+    msg.channel = channel
 
-    except Exception as e:
-        logging.error(f"Error processing message {msg.id}: {str(e)}")
-        msg.last_error = str(e)
-        transition(msg, "error")
+    # Check if the message should be blocked
+    if is_blocked(contact, msg):
+        logging.info(f"Message {msg.id} blocked by safety filters")
+        transition(msg, "blocked")
         return False
 
+    # Transition to queued state
+    transition(msg, "ok")
+    logging.info(f"Message {msg.id} processed successfully, channel: {msg.channel}")
+    return True
+
 
 def send_worker(msg: Message) -> bool:
     """
@@ -176,14 +334,14 @@ def send_worker(msg: Message) -> bool:
         return True
 
     except Exception as e:
-        msg.last_error = str(e)
+        msg.last_error_code = classify_error(e)
         msg.attempts += 1
-        logging.error(f"Failed to send message {msg.id} via {msg.channel}: {str(e)}. Attempt {msg.attempts}/{msg.max_attempts}")
+        logging.error("Failed to send message %s via %s: %s. Attempt %d/%d",
+                      msg.id, msg.channel, e, msg.attempts, msg.max_attempts)
 
         if msg.attempts < msg.max_attempts:
             transition(msg, "retry")
-            # Set retry time to 30 seconds from now
-            msg.retry_after = time.time() + 30
+            msg.retry_after = time.time() + retry_delay(msg.attempts)
             return False
         else:
             transition(msg, "fallback")
@@ -201,7 +359,7 @@ def fallback(msg: Message) -> bool:
         return False
 
     # Use the next fallback channel
-    msg.channel = msg.fallback_channels.pop(0)
+    msg.channel = msg.fallback_channels.popleft()
     msg.attempts = 0
     transition(msg, "reroute")
     logging.info(f"Message {msg.id} falling back to channel: {msg.channel}")
@@ -214,26 +372,26 @@ def send_via_channel(msg: Message):
     This would be implemented with actual channel adapters
     """
     if not msg.channel:
-        raise ValueError(f"No channel specified for message {msg.id}")
+        raise InvalidChannel(f"No channel specified for message {msg.id}")
 
     if msg.channel == "rcs":
         # Would connect to Android gateway
-        logging.info(f"Sending via RCS to {msg.to}: {msg.text[:50]}...")
+        logging.info("Sending via RCS to %s: %s", msg.to, msg._preview)
         # Actual implementation would connect to Android gateway
     elif msg.channel == "imessage":
         # Would connect to BlueBubbles
-        logging.info(f"Sending via iMessage to {msg.to}: {msg.text[:50]}...")
+        logging.info("Sending via iMessage to %s: %s", msg.to, msg._preview)
         # Actual implementation would connect to BlueBubbles
     elif msg.channel == "email":
         # Would use SMTP
-        logging.info(f"Sending via Email to {msg.to}: {msg.text[:50]}...")
+        logging.info("Sending via Email to %s: %s", msg.to, msg._preview)
         # Actual implementation would use SMTP
     elif msg.channel == "sms":
         # Would connect to Android gateway
-        logging.info(f"Sending via SMS to {msg.to}: {msg.text[:50]}...")
+        logging.info("Sending via SMS to %s: %s", msg.to, msg._preview)
         # Actual implementation would connect to Android gateway
     else:
-        raise ValueError(f"Unknown channel: {msg.channel}")
+        raise InvalidChannel(f"Unknown channel: {msg.channel}")
 
 
 def confirm_worker(msg: Message) -> bool:
@@ -273,36 +431,47 @@ def receipt_seen(msg: Message) -> bool:
         return random.random() < 0.8
 
 
+def retry_delay(attempts: int) -> float:
+    """
+    Seconds to wait before retry number `attempts` (1-based)
+    Exponential backoff capped at RETRY_MAX_DELAY, with jitter so that
+    messages failing together do not all retry at the same moment
+    """
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** (attempts - 1)))
+    return delay * random.uniform(0.5, 1.5)
+
+
+def human_delay_seconds() -> float:
+    """
+    Seconds of human-like delay to wait before a send
+    """
+    # Use a more realistic distribution for human-like delays
+    return random.uniform(HUMAN_DELAY_MIN, HUMAN_DELAY_MAX)
+
+
 def human_delay():
     """
     Add human-like delays before sending
     """
-    # Use a more realistic distribution for human-like delays
-    delay = random.uniform(1.2, 4.5)
-    time.sleep(delay)
+    time.sleep(human_delay_seconds())
 
 
 def is_blocked(contact, msg: Message) -> bool:
     """
     Safety check to prevent abuse
     """
-    try:
-        # Check if contact exists and has opted in
-        if contact is None:
-            return False  # Allow messages to unknown contacts (for new user onboarding)
-
-        if hasattr(contact, 'opt_in') and not contact.opt_in:
-            return True
+    # Check if contact exists and has opted in
+    if contact is None:
+        return False  # Allow messages to unknown contacts (for new user onboarding)
 
-        # Check if contact is blocked
-        if hasattr(contact, 'blocked') and contact.blocked:
-            return True
+    if hasattr(contact, 'opt_in') and not contact.opt_in:
+        return True
 
-        # Check message frequency per contact
-        # This would require access to historical data in a real implementation
-        # For now, we'll just return False
-        return False
+    # Check if contact is blocked
+    if hasattr(contact, 'blocked') and contact.blocked:
+        return True
 
-    except Exception as e:
-        logging.error(f"Error in is_blocked check: {str(e)}")
-        return True  # If there's an error, block the message as a safety measure
\ No newline at end of file
+    # Check message frequency per contact
+    # This would require access to historical data in a real implementation
+    # For now, we'll just return False
+    return False
@@ -1,36 +1,62 @@
 import redis.asyncio as redis
-from typing import Optional
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import NamedTuple, Optional
 import os
 
 
+class _RedisEnv(NamedTuple):
+    host: str
+    port: int
+    db: int
+    password: Optional[str]
+    ssl: bool
+
+
+@lru_cache(maxsize=1)
+def _env() -> _RedisEnv:
+    """
+    Read Redis settings from the environment (once, on first use)
+    """
+    return _RedisEnv(
+        host=os.getenv("REDIS_HOST", "localhost"),
+        port=int(os.getenv("REDIS_PORT", "6379")),
+        db=int(os.getenv("REDIS_DB", "0")),
+        password=os.getenv("REDIS_PASSWORD"),
+        ssl=os.getenv("REDIS_SSL", "false").lower() == "true"
+    )
+
+
+@dataclass(frozen=True, slots=True)
 class RedisConfig:
-    def __init__(
-        self,
-        host: str = os.getenv("REDIS_HOST", "localhost"),
-        port: int = int(os.getenv("REDIS_PORT", "6379")),
-        db: int = int(os.getenv("REDIS_DB", "0")),
-        password: Optional[str] = os.getenv("REDIS_PASSWORD"),
-        ssl: bool = os.getenv("REDIS_SSL", "false").lower() == "true"
-    ):
-        self.host = host
-        self.port = port
-        self.db = db
-        self.password = password
-        self.ssl = ssl
+    """Redis connection settings, defaulting to the REDIS_* environment variables"""
+    host: str = field(default_factory=lambda: _env().host)
+    port: int = field(default_factory=lambda: _env().port)
+    db: int = field(default_factory=lambda: _env().db)
+    password: Optional[str] = field(default_factory=lambda: _env().password)
+    ssl: bool = field(default_factory=lambda: _env().ssl)
+    max_connections: int = 32
+    pool_timeout: int = 5  # Seconds to wait for a free connection
 
 
 def create_redis_client(config: RedisConfig) -> redis.Redis:
     """
     Create and return a Redis client instance
+    Connections come from a bounded pool: callers wait up to pool_timeout
+    for a free connection instead of opening new ones under bursts.
+    Replies are parsed by hiredis when it is installed
     """
-    return redis.Redis(
+    pool = redis.BlockingConnectionPool(
+        max_connections=config.max_connections,
+        timeout=config.pool_timeout,
+        connection_class=redis.SSLConnection if config.ssl else redis.Connection,
         host=config.host,
         port=config.port,
         db=config.db,
         password=config.password,
-        ssl=config.ssl,
         decode_responses=True
     )
+    return redis.Redis(connection_pool=pool)
 
 
 # Global Redis client instance
@@ -1,12 +1,146 @@
-from typing import Dict, List, Optional, Any
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Any, Union
 from enum import Enum
 import sqlite3
-import json
+import orjson
 import logging
+import queue
 from datetime import datetime
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, asdict, field
 from contextlib import contextmanager
 import threading
+import weakref
+
+
+# Seconds between background PRAGMA optimize runs
+OPTIMIZE_INTERVAL = 15 * 60
+
+# Pooled connections per ContactManager; SQLite work is I/O bound, so this
+# is not tied to the CPU count
+DEFAULT_POOL_SIZE = 8
+
+# Seconds to wait for a free pooled connection before giving up
+POOL_ACQUIRE_TIMEOUT = 10.0
+
+# Canonical statements, kept as constants so each connection's statement
+# cache hits on every call instead of re-preparing
+_SQL_INSERT = """
+    INSERT INTO contacts (
+        id, name, phone, email, imessage_capable, rcs_capable,
+        preferred_channel, opt_in, last_contact_date, message_count,
+        blocked, tags
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+_SQL_UPSERT = _SQL_INSERT + """
+    ON CONFLICT(id) DO UPDATE SET
+        name = excluded.name,
+        phone = excluded.phone,
+        email = excluded.email,
+        imessage_capable = excluded.imessage_capable,
+        rcs_capable = excluded.rcs_capable,
+        preferred_channel = excluded.preferred_channel,
+        opt_in = excluded.opt_in,
+        updated_at = CURRENT_TIMESTAMP,
+        last_contact_date = excluded.last_contact_date,
+        message_count = excluded.message_count,
+        blocked = excluded.blocked,
+        tags = excluded.tags
+"""
+_SQL_UPDATE = """
+    UPDATE contacts SET
+        name = ?,
+        phone = ?,
+        email = ?,
+        imessage_capable = ?,
+        rcs_capable = ?,
+        preferred_channel = ?,
+        opt_in = ?,
+        updated_at = CURRENT_TIMESTAMP,
+        last_contact_date = ?,
+        message_count = ?,
+        blocked = ?,
+        tags = ?
+    WHERE id = ?
+"""
+_SQL_GET_BY_ID = "SELECT * FROM contacts WHERE id = ?"
+_SQL_GET_BY_PHONE = "SELECT * FROM contacts WHERE phone = ?"
+_SQL_GET_BY_EMAIL = "SELECT * FROM contacts WHERE email = ?"
+_SQL_GET_BY_IDENTIFIER = "SELECT * FROM contacts WHERE phone = ? OR email = ? LIMIT 1"
+_SQL_GET_HINT_BY_IDENTIFIER = """
+    SELECT id, opt_in, blocked, imessage_capable, rcs_capable, preferred_channel, phone, email
+    FROM contacts WHERE phone = ? OR email = ? LIMIT 1
+"""
+_SQL_SEARCH = """
+    SELECT * FROM contacts
+    WHERE name LIKE :q OR phone LIKE :q OR email LIKE :q
+    ORDER BY name COLLATE NOCASE
+    LIMIT :limit OFFSET :offset
+"""
+_SQL_SEARCH_FTS = """
+    SELECT c.* FROM contacts_fts
+    JOIN contacts c ON c.rowid = contacts_fts.rowid
+    WHERE contacts_fts MATCH ?
+    ORDER BY rank
+    LIMIT ? OFFSET ?
+"""
+_SQL_GET_ALL = "SELECT * FROM contacts ORDER BY name COLLATE NOCASE LIMIT ? OFFSET ?"
+_SQL_DELETE = "DELETE FROM contacts WHERE id = ?"
+_SQL_INCREMENT_MESSAGE_COUNT = """
+    UPDATE contacts
+    SET message_count = message_count + 1,
+        last_contact_date = CURRENT_TIMESTAMP
+    WHERE id = ?
+"""
+_SQL_STATS = """
+    SELECT
+        COUNT(*) AS total,
+        COALESCE(SUM(opt_in = 1), 0) AS opted_in,
+        COALESCE(SUM(blocked = 1), 0) AS blocked,
+        COALESCE(SUM(imessage_capable = 1), 0) AS imessage,
+        COALESCE(SUM(rcs_capable = 1), 0) AS rcs,
+        COALESCE(SUM(email IS NOT NULL), 0) AS email,
+        COALESCE(SUM(phone IS NOT NULL), 0) AS phone
+    FROM contacts
+"""
+
+# Trigram FTS5 index over the searchable columns; trigram matching keeps the
+# substring semantics of LIKE '%query%' for queries of 3+ characters
+_SQL_CREATE_SEARCH_INDEX = (
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS contacts_fts USING fts5(
+        name, phone, email, content='contacts', content_rowid='rowid', tokenize='trigram'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS contacts_fts_insert AFTER INSERT ON contacts BEGIN
+        INSERT INTO contacts_fts(rowid, name, phone, email)
+        VALUES (new.rowid, new.name, new.phone, new.email);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS contacts_fts_delete AFTER DELETE ON contacts BEGIN
+        INSERT INTO contacts_fts(contacts_fts, rowid, name, phone, email)
+        VALUES ('delete', old.rowid, old.name, old.phone, old.email);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS contacts_fts_update AFTER UPDATE OF name, phone, email ON contacts BEGIN
+        INSERT INTO contacts_fts(contacts_fts, rowid, name, phone, email)
+        VALUES ('delete', old.rowid, old.name, old.phone, old.email);
+        INSERT INTO contacts_fts(rowid, name, phone, email)
+        VALUES (new.rowid, new.name, new.phone, new.email);
+    END
+    """,
+)
+_FTS_MIN_QUERY_LENGTH = 3  # Trigrams cannot match shorter strings
+
+# Row cap for search_contacts
+DEFAULT_SEARCH_LIMIT = 100
+
+# Row cap for get_all_contacts when no limit is given
+DEFAULT_CONTACTS_LIMIT = 1000
+
+# Rows fetched per pooled connection checkout when streaming contacts
+ITER_CHUNK_SIZE = 256
 
 
 class ChannelPreference(Enum):
@@ -17,7 +151,11 @@ class ChannelPreference(Enum):
     IMESSAGE = "imessage"
 
 
-@dataclass
+# Stored value -> member, for re-hydrating rows without Enum.__call__
+_CHANNEL_BY_VALUE = {cp.value: cp for cp in ChannelPreference}
+
+
+@dataclass(slots=True)
 class Contact:
     """Data class representing a contact"""
     id: str
@@ -28,55 +166,240 @@ class Contact:
     rcs_capable: bool = False
     preferred_channel: Optional[ChannelPreference] = None
     opt_in: bool = True
-    created_at: Optional[datetime] = None
-    updated_at: Optional[datetime] = None
+    created_at: datetime = field(default_factory=datetime.now)
+    updated_at: datetime = field(default_factory=datetime.now)
     last_contact_date: Optional[datetime] = None
     message_count: int = 0
     blocked: bool = False
-    tags: List[str] = None
+    tags: List[str] = field(default_factory=list)
+
+
+class _LazyDatetime:
+    """
+    Wraps a Contact timestamp slot so that ISO-8601 strings loaded from the
+    database are only parsed into datetimes when the attribute is first read
+    """
+    __slots__ = ("_slot",)
+
+    def __init__(self, slot):
+        self._slot = slot
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        value = self._slot.__get__(obj, objtype)
+        if value.__class__ is str:
+            value = datetime.fromisoformat(value)
+            self._slot.__set__(obj, value)
+        return value
+
+    def __set__(self, obj, value):
+        self._slot.__set__(obj, value)
+
+
+for _name in ("created_at", "updated_at", "last_contact_date"):
+    setattr(Contact, _name, _LazyDatetime(getattr(Contact, _name)))
+del _name
+
+
+def _contact_row_factory(cursor: sqlite3.Cursor, row: tuple) -> Contact:
+    """
+    Build a Contact straight from a SELECT * row of the contacts table
+    Columns: id, name, phone, email, imessage_capable, rcs_capable, preferred_channel,
+    opt_in, created_at, updated_at, last_contact_date, message_count, blocked, tags
+    """
+    try:
+        return Contact(
+            row[0], row[1], row[2], row[3],
+            bool(row[4]), bool(row[5]), _CHANNEL_BY_VALUE.get(row[6]), bool(row[7]),
+            # Timestamps stay ISO strings until read (see _LazyDatetime)
+            row[8] or None, row[9] or None, row[10] or None,
+            row[11] or 0, bool(row[12]),
+            orjson.loads(row[13]) if row[13] else []
+        )
+    except Exception as e:
+        logging.error("Error converting database row to Contact object: %s", e)
+        # Return a minimal contact object in case of conversion error
+        return Contact(id=row[0], name=row[1], phone=row[2], email=row[3])
+
+
+class ContactHint(NamedTuple):
+    """
+    The fields the send path needs to gate and route a message
+    Attribute names match Contact, so either can be passed to the
+    opt-in and channel selection helpers
+    """
+    id: str
+    opt_in: bool
+    blocked: bool
+    imessage_capable: bool
+    rcs_capable: bool
+    preferred_channel: Optional[ChannelPreference]
+    phone: Optional[str]
+    email: Optional[str]
+
+
+# Channels in fallback priority order, paired with the capability bit each needs
+_CHANNEL_BITS = (
+    (ChannelPreference.IMESSAGE, 1 << 0),
+    (ChannelPreference.RCS, 1 << 1),
+    (ChannelPreference.EMAIL, 1 << 2),
+    (ChannelPreference.SMS, 1 << 3),
+)
+
+# Routing tables indexed by _capability_mask(contact)
+_FALLBACKS_BY_MASK = tuple(
+    tuple(channel for channel, bit in _CHANNEL_BITS if mask & bit)
+    for mask in range(16)
+)
+_PREFERRED_BY_MASK = tuple(
+    channels[0] if channels else ChannelPreference.SMS
+    for channels in _FALLBACKS_BY_MASK
+)
+# Preferred channel first, then the rest of the capability order without repeats
+_FALLBACKS_BY_PREFERENCE = {
+    (preferred, mask): (preferred,) + tuple(ch for ch in channels if ch is not preferred)
+    for preferred in ChannelPreference
+    for mask, channels in enumerate(_FALLBACKS_BY_MASK)
+}
+
+
+def _capability_mask(contact: Union[Contact, ContactHint]) -> int:
+    """Pack a contact's channel capabilities into a 4-bit index"""
+    return (bool(contact.imessage_capable)
+            | bool(contact.rcs_capable) << 1
+            | bool(contact.email) << 2
+            | bool(contact.phone) << 3)
+
+
+def _run_optimize(manager_ref: "weakref.ref[ContactManager]"):
+    """
+    Optimize timer callback
+    Holds the manager weakly so the timer alone does not keep it alive; once the
+    manager is collected the timer stops rescheduling itself
+    """
+    manager = manager_ref()
+    if manager is not None:
+        manager._optimize()
+
+
+class _ConnectionPool:
+    """Fixed set of open SQLite connections shared between threads"""
+
+    def __init__(self, connect, size: int, timeout: float = POOL_ACQUIRE_TIMEOUT):
+        self._timeout = timeout
+        self._all = [connect() for _ in range(size)]
+        self._idle: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        for conn in self._all:
+            self._idle.put(conn)
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get(timeout=self._timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No pooled connection free after {self._timeout}s") from None
+
+    def release(self, conn: sqlite3.Connection):
+        conn.rollback()  # Never hand out a connection with an open transaction
+        self._idle.put(conn)
 
-    def __post_init__(self):
-        if self.tags is None:
-            self.tags = []
-        if self.created_at is None:
-            self.created_at = datetime.now()
-        if self.updated_at is None:
-            self.updated_at = datetime.now()
+    def close(self):
+        for conn in self._all:
+            conn.close()
 
 
 class ContactManager:
     """Manages contacts and their preferences"""
 
-    def __init__(self, db_path: str = "contacts.db"):
+    def __init__(self, db_path: str = "contacts.db", pool_size: Optional[int] = None):
         self.db_path = db_path
-        self.lock = threading.Lock()  # Thread-safe operations
+        self._optimize_timer: Optional[threading.Timer] = None
+        self._fts_enabled = False
+
+        if db_path == ":memory:":
+            # Pooled connections must all see the same in-memory database
+            self._database = f"file:contacts-{id(self)}?mode=memory&cache=shared"
+            self._uri = True
+        else:
+            self._database = db_path
+            self._uri = False
+
+        self._pool = _ConnectionPool(self._connect, pool_size or DEFAULT_POOL_SIZE)
         self.init_db()
+        self._schedule_optimize()
 
     def init_db(self):
         """Initialize the contacts database"""
         try:
             with self._get_connection() as conn:
+                # WAL lets readers run alongside a writer; it is persistent for the file
+                conn.execute("PRAGMA journal_mode=WAL")
+            with self._transaction() as conn:
                 cursor = conn.cursor()
                 self._create_table_if_not_exists(cursor)
         except Exception as e:
-            logging.error(f"Failed to initialize database: {e}")
+            logging.error("Failed to initialize database: %s", e)
             raise
 
+    def _schedule_optimize(self):
+        """Run PRAGMA optimize every OPTIMIZE_INTERVAL seconds in the background"""
+        self._optimize_timer = threading.Timer(OPTIMIZE_INTERVAL, _run_optimize, args=(weakref.ref(self),))
+        self._optimize_timer.daemon = True
+        self._optimize_timer.start()
+
+    def _optimize(self):
+        """Let SQLite refresh query planner statistics, then reschedule"""
+        try:
+            with self._get_connection() as conn:
+                conn.execute("PRAGMA optimize")
+        except Exception as e:
+            logging.warning("PRAGMA optimize failed: %s", e)
+        self._schedule_optimize()
+
+    def close(self):
+        """Stop background maintenance and close all connections"""
+        if self._optimize_timer:
+            self._optimize_timer.cancel()
+            self._optimize_timer = None
+        self._pool.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a connection with the per-connection pragmas applied"""
+        conn = sqlite3.connect(
+            self._database, timeout=10.0, check_same_thread=False, uri=self._uri,
+            cached_statements=256, isolation_level=None  # Autocommit; writes use explicit transactions
+        )
+        conn.row_factory = sqlite3.Row  # Enable column access by name
+        conn.execute("PRAGMA synchronous=NORMAL")  # Safe under WAL, fewer fsyncs per commit
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-20000")  # ~20MB page cache
+        return conn
+
     @contextmanager
     def _get_connection(self):
-        """Context manager for database connections"""
-        conn = None
+        """Borrow a pooled connection (autocommit mode) for reads"""
+        conn = self._pool.acquire()
         try:
-            conn = sqlite3.connect(self.db_path, timeout=10.0)
-            conn.row_factory = sqlite3.Row  # Enable column access by name
             yield conn
-        except Exception as e:
-            if conn:
-                conn.rollback()
-            raise e
         finally:
-            if conn:
-                conn.close()
+            self._pool.release(conn)
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Borrow a pooled connection inside BEGIN IMMEDIATE ... COMMIT
+        SQLite serializes writers itself; a writer that finds the database
+        locked waits up to busy_timeout before failing
+        """
+        with self._get_connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
 
     def _create_table_if_not_exists(self, cursor):
         """Create the contacts table if it doesn't exist"""
@@ -100,79 +423,110 @@ class ContactManager:
             )
         """)
 
+        # Single-column lookups and name ordering
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_contacts_phone ON contacts(phone)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_contacts_email ON contacts(email)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_contacts_name ON contacts(name COLLATE NOCASE)")
+
+        self._fts_enabled = self._create_search_index(cursor)
+
+    def _create_search_index(self, cursor) -> bool:
+        """
+        Create the FTS5 substring index used by search_contacts, kept in sync by triggers
+        Returns False if this SQLite build lacks FTS5/trigram support
+        """
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'contacts_fts'")
+        exists = cursor.fetchone() is not None
+
+        try:
+            for statement in _SQL_CREATE_SEARCH_INDEX:
+                cursor.execute(statement)
+        except sqlite3.OperationalError as e:
+            logging.warning("Full-text search unavailable, falling back to LIKE scans: %s", e)
+            return False
+
+        if not exists:
+            # Index rows that were stored before the search index existed
+            cursor.execute("INSERT INTO contacts_fts(contacts_fts) VALUES ('rebuild')")
+        return True
+
+    @staticmethod
+    def _insert_params(contact: Contact) -> tuple:
+        """Parameters for _SQL_INSERT, in column order"""
+        return (
+            contact.id, contact.name, contact.phone, contact.email,
+            contact.imessage_capable, contact.rcs_capable,
+            contact.preferred_channel.value if contact.preferred_channel else None,
+            contact.opt_in, contact.last_contact_date, contact.message_count,
+            contact.blocked, orjson.dumps(contact.tags).decode()
+        )
+
     def add_contact(self, contact: Contact) -> bool:
         """Add a new contact to the database"""
+        if self.add_contacts([contact]) == 1:
+            logging.info("Contact %s added successfully", contact.name)
+            return True
+        return False
+
+    def add_contacts(self, contacts: Iterable[Contact]) -> int:
+        """
+        Add many contacts in a single transaction
+        The batch is all-or-nothing: if any contact conflicts, none are added.
+        Returns the number of contacts inserted
+        """
         try:
-            with self.lock:  # Ensure thread safety
-                with self._get_connection() as conn:
-                    cursor = conn.cursor()
-                    self._create_table_if_not_exists(cursor)
-
-                    cursor.execute("""
-                        INSERT INTO contacts (
-                            id, name, phone, email, imessage_capable, rcs_capable,
-                            preferred_channel, opt_in, last_contact_date, message_count,
-                            blocked, tags
-                        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """, (
-                        contact.id, contact.name, contact.phone, contact.email,
-                        contact.imessage_capable, contact.rcs_capable,
-                        contact.preferred_channel.value if contact.preferred_channel else None,
-                        contact.opt_in, contact.last_contact_date, contact.message_count,
-                        contact.blocked, json.dumps(contact.tags)
-                    ))
-
-                    conn.commit()
-                    logging.info(f"Contact {contact.name} added successfully")
-                    return True
+            with self._transaction() as conn:
+                cursor = conn.cursor()
+                cursor.executemany(_SQL_INSERT, (self._insert_params(contact) for contact in contacts))
+                return cursor.rowcount
+        except sqlite3.IntegrityError as e:
+            logging.warning("Contact with phone/email already exists: %s", e)
+            return 0
+        except Exception as e:
+            logging.error("Error adding contacts: %s", e)
+            return 0
+
+    def upsert_contact(self, contact: Contact) -> bool:
+        """
+        Add a contact, or overwrite the stored one with the same ID
+        Still fails if the phone or email belongs to a different contact
+        """
+        try:
+            with self._transaction() as conn:
+                conn.execute(_SQL_UPSERT, self._insert_params(contact))
+                logging.info("Contact %s saved successfully", contact.name)
+                return True
         except sqlite3.IntegrityError as e:
-            logging.warning(f"Contact with phone/email already exists: {e}")
+            logging.warning("Contact with phone/email already exists: %s", e)
             return False
         except Exception as e:
-            logging.error(f"Error adding contact {contact.name}: {e}")
+            logging.error("Error saving contact %s: %s", contact.name, e)
             return False
 
     def update_contact(self, contact: Contact) -> bool:
         """Update an existing contact"""
         try:
-            with self.lock:  # Ensure thread safety
-                with self._get_connection() as conn:
-                    cursor = conn.cursor()
-
-                    cursor.execute("""
-                        UPDATE contacts SET
-                            name = ?,
-                            phone = ?,
-                            email = ?,
-                            imessage_capable = ?,
-                            rcs_capable = ?,
-                            preferred_channel = ?,
-                            opt_in = ?,
-                            updated_at = CURRENT_TIMESTAMP,
-                            last_contact_date = ?,
-                            message_count = ?,
-                            blocked = ?,
-                            tags = ?
-                        WHERE id = ?
-                    """, (
-                        contact.name, contact.phone, contact.email,
-                        contact.imessage_capable, contact.rcs_capable,
-                        contact.preferred_channel.value if contact.preferred_channel else None,
-                        contact.opt_in, contact.last_contact_date, contact.message_count,
-                        contact.blocked, json.dumps(contact.tags), contact.id
-                    ))
-
-                    rows_affected = cursor.rowcount
-                    conn.commit()
-
-                    if rows_affected > 0:
-                        logging.info(f"Contact {contact.name} updated successfully")
-                        return True
-                    else:
-                        logging.warning(f"Contact with ID {contact.id} not found for update")
-                        return False
+            with self._transaction() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute(_SQL_UPDATE, (
+                    contact.name, contact.phone, contact.email,
+                    contact.imessage_capable, contact.rcs_capable,
+                    contact.preferred_channel.value if contact.preferred_channel else None,
+                    contact.opt_in, contact.last_contact_date, contact.message_count,
+                    contact.blocked, orjson.dumps(contact.tags).decode(), contact.id
+                ))
+
+                rows_affected = cursor.rowcount
+
+                if rows_affected > 0:
+                    logging.info("Contact %s updated successfully", contact.name)
+                    return True
+                else:
+                    logging.warning("Contact with ID %s not found for update", contact.id)
+                    return False
         except Exception as e:
-            logging.error(f"Error updating contact {contact.name}: {e}")
+            logging.error("Error updating contact %s: %s", contact.name, e)
             return False
 
     def get_contact_by_id(self, contact_id: str) -> Optional[Contact]:
@@ -180,14 +534,11 @@ class ContactManager:
         try:
             with self._get_connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute("SELECT * FROM contacts WHERE id = ?", (contact_id,))
-                row = cursor.fetchone()
-
-                if row:
-                    return self._row_to_contact(row)
-                return None
+                cursor.row_factory = _contact_row_factory
+                cursor.execute(_SQL_GET_BY_ID, (contact_id,))
+                return cursor.fetchone()
         except Exception as e:
-            logging.error(f"Error retrieving contact by ID {contact_id}: {e}")
+            logging.error("Error retrieving contact by ID %s: %s", contact_id, e)
             return None
 
     def get_contact_by_phone(self, phone: str) -> Optional[Contact]:
@@ -195,16 +546,12 @@ class ContactManager:
         try:
             with self._get_connection() as conn:
                 cursor = conn.cursor()
-                self._create_table_if_not_exists(cursor)
+                cursor.row_factory = _contact_row_factory
 
-                cursor.execute("SELECT * FROM contacts WHERE phone = ?", (phone,))
-                row = cursor.fetchone()
-
-                if row:
-                    return self._row_to_contact(row)
-                return None
+                cursor.execute(_SQL_GET_BY_PHONE, (phone,))
+                return cursor.fetchone()
         except Exception as e:
-            logging.error(f"Error retrieving contact by phone {phone}: {e}")
+            logging.error("Error retrieving contact by phone %s: %s", phone, e)
             return None
 
     def get_contact_by_email(self, email: str) -> Optional[Contact]:
@@ -212,176 +559,154 @@ class ContactManager:
         try:
             with self._get_connection() as conn:
                 cursor = conn.cursor()
+                cursor.row_factory = _contact_row_factory
 
-                cursor.execute("SELECT * FROM contacts WHERE email = ?", (email,))
-                row = cursor.fetchone()
+                cursor.execute(_SQL_GET_BY_EMAIL, (email,))
+                return cursor.fetchone()
+        except Exception as e:
+            logging.error("Error retrieving contact by email %s: %s", email, e)
+            return None
 
-                if row:
-                    return self._row_to_contact(row)
-                return None
+    def get_contact_by_identifier(self, identifier: str) -> Optional[Contact]:
+        """Retrieve a contact by phone number or email address in one query"""
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.row_factory = _contact_row_factory
+
+                cursor.execute(_SQL_GET_BY_IDENTIFIER, (identifier, identifier))
+                return cursor.fetchone()
         except Exception as e:
-            logging.error(f"Error retrieving contact by email {email}: {e}")
+            logging.error("Error retrieving contact by identifier %s: %s", identifier, e)
             return None
 
-    def search_contacts(self, query: str) -> List[Contact]:
-        """Search contacts by name, phone, or email"""
+    def get_channel_hint_by_identifier(self, identifier: str) -> Optional[ContactHint]:
+        """Retrieve just the routing fields of a contact by phone number or email"""
         try:
             with self._get_connection() as conn:
                 cursor = conn.cursor()
 
-                cursor.execute("""
-                    SELECT * FROM contacts
-                    WHERE name LIKE ? OR phone LIKE ? OR email LIKE ?
-                    ORDER BY name
-                """, (f"%{query}%", f"%{query}%", f"%{query}%"))
+                cursor.execute(_SQL_GET_HINT_BY_IDENTIFIER, (identifier, identifier))
+                row = cursor.fetchone()
 
-                rows = cursor.fetchall()
-                return [self._row_to_contact(row) for row in rows]
+                if row:
+                    return ContactHint(
+                        row[0], bool(row[1]), bool(row[2]), bool(row[3]), bool(row[4]),
+                        _CHANNEL_BY_VALUE.get(row[5]), row[6], row[7]
+                    )
+                return None
         except Exception as e:
-            logging.error(f"Error searching contacts with query '{query}': {e}")
-            return []
+            logging.error("Error retrieving channel hint for %s: %s", identifier, e)
+            return None
 
-    def get_all_contacts(self, limit: Optional[int] = None, offset: int = 0) -> List[Contact]:
-        """Retrieve all contacts with optional pagination"""
-        try:
+    def _iter_contact_pages(self, sql: str, params, limit: int, offset: int = 0) -> Iterator[Contact]:
+        """
+        Stream up to `limit` contacts from a LIMIT/OFFSET query, ITER_CHUNK_SIZE at a time
+        params(count, offset) gives the statement parameters for each chunk. The
+        pooled connection is returned before a chunk is yielded, so callers may
+        use the manager while iterating.
+        """
+        while limit > 0:
+            count = min(limit, ITER_CHUNK_SIZE)
             with self._get_connection() as conn:
                 cursor = conn.cursor()
+                cursor.row_factory = _contact_row_factory
+                cursor.execute(sql, params(count, offset))
+                page = cursor.fetchall()
+
+            yield from page
+            if len(page) < count:
+                return
+            limit -= count
+            offset += count
+
+    def iter_search_contacts(self, query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> Iterator[Contact]:
+        """Stream contacts matching a name, phone, or email search, best matches first"""
+        try:
+            if self._fts_enabled and len(query) >= _FTS_MIN_QUERY_LENGTH:
+                # Quote as an FTS5 string so the query is matched literally
+                match = '"' + query.replace('"', '""') + '"'
+                yield from self._iter_contact_pages(
+                    _SQL_SEARCH_FTS, lambda count, offset: (match, count, offset), limit
+                )
+            else:
+                pattern = f"%{query}%"
+                yield from self._iter_contact_pages(
+                    _SQL_SEARCH, lambda count, offset: {"q": pattern, "limit": count, "offset": offset}, limit
+                )
+        except Exception as e:
+            logging.error("Error searching contacts with query '%s': %s", query, e)
 
-                query = "SELECT * FROM contacts ORDER BY name"
-                params = []
+    def search_contacts(self, query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> List[Contact]:
+        """Search contacts by name, phone, or email"""
+        return list(self.iter_search_contacts(query, limit))
 
-                if limit is not None:
-                    query += " LIMIT ? OFFSET ?"
-                    params.extend([limit, offset])
-                else:
-                    query += " LIMIT 1000"  # Prevent loading too many records at once
-                    params.append(1000)
+    def iter_all_contacts(self, limit: Optional[int] = None, offset: int = 0) -> Iterator[Contact]:
+        """Stream all contacts with optional pagination"""
+        if limit is None:
+            limit = DEFAULT_CONTACTS_LIMIT  # Prevent loading too many records at once
 
-                cursor.execute(query, params)
-                rows = cursor.fetchall()
-                return [self._row_to_contact(row) for row in rows]
+        try:
+            yield from self._iter_contact_pages(_SQL_GET_ALL, lambda count, offset: (count, offset), limit, offset)
         except Exception as e:
-            logging.error(f"Error retrieving all contacts: {e}")
-            return []
+            logging.error("Error retrieving all contacts: %s", e)
+
+    def get_all_contacts(self, limit: Optional[int] = None, offset: int = 0) -> List[Contact]:
+        """Retrieve all contacts with optional pagination"""
+        return list(self.iter_all_contacts(limit, offset))
 
     def delete_contact(self, contact_id: str) -> bool:
         """Delete a contact by ID"""
         try:
-            with self.lock:  # Ensure thread safety
-                with self._get_connection() as conn:
-                    cursor = conn.cursor()
-
-                    cursor.execute("DELETE FROM contacts WHERE id = ?", (contact_id,))
-                    rows_affected = cursor.rowcount
-                    conn.commit()
-
-                    if rows_affected > 0:
-                        logging.info(f"Contact with ID {contact_id} deleted successfully")
-                        return True
-                    else:
-                        logging.warning(f"Contact with ID {contact_id} not found for deletion")
-                        return False
+            with self._transaction() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute(_SQL_DELETE, (contact_id,))
+                rows_affected = cursor.rowcount
+
+                if rows_affected > 0:
+                    logging.info("Contact with ID %s deleted successfully", contact_id)
+                    return True
+                else:
+                    logging.warning("Contact with ID %s not found for deletion", contact_id)
+                    return False
         except Exception as e:
-            logging.error(f"Error deleting contact with ID {contact_id}: {e}")
+            logging.error("Error deleting contact with ID %s: %s", contact_id, e)
             return False
 
     def increment_message_count(self, contact_id: str) -> bool:
         """Increment the message count for a contact"""
         try:
-            with self.lock:  # Ensure thread safety
-                with self._get_connection() as conn:
-                    cursor = conn.cursor()
-
-                    cursor.execute("""
-                        UPDATE contacts
-                        SET message_count = message_count + 1,
-                            last_contact_date = CURRENT_TIMESTAMP
-                        WHERE id = ?
-                    """, (contact_id,))
-
-                    rows_affected = cursor.rowcount
-                    conn.commit()
-
-                    if rows_affected > 0:
-                        logging.info(f"Message count incremented for contact {contact_id}")
-                        return True
-                    else:
-                        logging.warning(f"Contact with ID {contact_id} not found for message count increment")
-                        return False
-        except Exception as e:
-            logging.error(f"Error incrementing message count for contact {contact_id}: {e}")
-            return False
-
-    def get_preferred_channel(self, contact: Contact) -> ChannelPreference:
-        """Get the preferred channel for a contact"""
-        # If contact has a preferred channel, use it
-        if contact.preferred_channel:
-            return contact.preferred_channel
-
-        # Otherwise, determine based on capabilities
-        if contact.imessage_capable:
-            return ChannelPreference.IMESSAGE
-        elif contact.rcs_capable:
-            return ChannelPreference.RCS
-        elif contact.email:
-            return ChannelPreference.EMAIL
-        elif contact.phone:
-            return ChannelPreference.SMS
-
-        # Default to SMS if no other options
-        return ChannelPreference.SMS
-
-    def get_fallback_channels(self, contact: Contact) -> List[ChannelPreference]:
-        """Get fallback channels for a contact in priority order"""
-        channels = []
-
-        # Add preferred channel first if set
-        if contact.preferred_channel and contact.preferred_channel not in channels:
-            channels.append(contact.preferred_channel)
-
-        # Add other available channels in priority order
-        if contact.imessage_capable and ChannelPreference.IMESSAGE not in channels:
-            channels.append(ChannelPreference.IMESSAGE)
+            with self._transaction() as conn:
+                cursor = conn.cursor()
 
-        if contact.rcs_capable and ChannelPreference.RCS not in channels:
-            channels.append(ChannelPreference.RCS)
+                cursor.execute(_SQL_INCREMENT_MESSAGE_COUNT, (contact_id,))
 
-        if contact.email and ChannelPreference.EMAIL not in channels:
-            channels.append(ChannelPreference.EMAIL)
+                rows_affected = cursor.rowcount
 
-        if contact.phone and ChannelPreference.SMS not in channels:
-            channels.append(ChannelPreference.SMS)
+                if rows_affected > 0:
+                    # Called once per sent message; skip the record entirely unless debugging
+                    if logging.getLogger().isEnabledFor(logging.DEBUG):
+                        logging.debug("Message count incremented for contact %s", contact_id)
+                    return True
+                else:
+                    logging.warning("Contact with ID %s not found for message count increment", contact_id)
+                    return False
+        except Exception as e:
+            logging.error("Error incrementing message count for contact %s: %s", contact_id, e)
+            return False
 
-        return channels
+    def get_preferred_channel(self, contact: Union[Contact, ContactHint]) -> ChannelPreference:
+        """Get the preferred channel for a contact"""
+        # An explicit preference wins; otherwise the best capability, defaulting to SMS
+        return contact.preferred_channel or _PREFERRED_BY_MASK[_capability_mask(contact)]
 
-    def _row_to_contact(self, row) -> Contact:
-        """Convert a database row to a Contact object"""
-        try:
-            return Contact(
-                id=row['id'],
-                name=row['name'],
-                phone=row['phone'],
-                email=row['email'],
-                imessage_capable=bool(row['imessage_capable']),
-                rcs_capable=bool(row['rcs_capable']),
-                preferred_channel=ChannelPreference(row['preferred_channel']) if row['preferred_channel'] else None,
-                opt_in=bool(row['opt_in']),
-                created_at=datetime.fromisoformat(row['created_at']) if row['created_at'] else None,
-                updated_at=datetime.fromisoformat(row['updated_at']) if row['updated_at'] else None,
-                last_contact_date=datetime.fromisoformat(row['last_contact_date']) if row['last_contact_date'] else None,
-                message_count=row['message_count'] if row['message_count'] else 0,
-                blocked=bool(row['blocked']),
-                tags=json.loads(row['tags']) if row['tags'] else []
-            )
-        except Exception as e:
-            logging.error(f"Error converting database row to Contact object: {e}")
-            # Return a minimal contact object in case of conversion error
-            return Contact(
-                id=row['id'],
-                name=row['name'],
-                phone=row['phone'],
-                email=row['email']
-            )
+    def get_fallback_channels(self, contact: Union[Contact, ContactHint]) -> List[ChannelPreference]:
+        """Get fallback channels for a contact in priority order"""
+        mask = _capability_mask(contact)
+        if contact.preferred_channel:
+            return list(_FALLBACKS_BY_PREFERENCE[contact.preferred_channel, mask])
+        return list(_FALLBACKS_BY_MASK[mask])
 
     def get_contact_stats(self) -> Dict[str, Any]:
         """Get statistics about contacts in the database"""
@@ -389,47 +714,40 @@ class ContactManager:
             with self._get_connection() as conn:
                 cursor = conn.cursor()
 
-                # Count total contacts
-                cursor.execute("SELECT COUNT(*) as count FROM contacts")
-                total_contacts = cursor.fetchone()['count']
-
-                # Count opted-in contacts
-                cursor.execute("SELECT COUNT(*) as count FROM contacts WHERE opt_in = 1")
-                opted_in_contacts = cursor.fetchone()['count']
-
-                # Count blocked contacts
-                cursor.execute("SELECT COUNT(*) as count FROM contacts WHERE blocked = 1")
-                blocked_contacts = cursor.fetchone()['count']
-
-                # Count contacts by channel capability
-                cursor.execute("SELECT COUNT(*) as count FROM contacts WHERE imessage_capable = 1")
-                imessage_contacts = cursor.fetchone()['count']
-
-                cursor.execute("SELECT COUNT(*) as count FROM contacts WHERE rcs_capable = 1")
-                rcs_contacts = cursor.fetchone()['count']
-
-                cursor.execute("SELECT COUNT(*) as count FROM contacts WHERE email IS NOT NULL")
-                email_contacts = cursor.fetchone()['count']
-
-                cursor.execute("SELECT COUNT(*) as count FROM contacts WHERE phone IS NOT NULL")
-                phone_contacts = cursor.fetchone()['count']
+                # All counts in a single pass over the table
+                cursor.execute(_SQL_STATS)
+                row = cursor.fetchone()
 
                 return {
-                    'total_contacts': total_contacts,
-                    'opted_in_contacts': opted_in_contacts,
-                    'blocked_contacts': blocked_contacts,
-                    'imessage_capable': imessage_contacts,
-                    'rcs_capable': rcs_contacts,
-                    'email_enabled': email_contacts,
-                    'phone_enabled': phone_contacts
+                    'total_contacts': row['total'],
+                    'opted_in_contacts': row['opted_in'],
+                    'blocked_contacts': row['blocked'],
+                    'imessage_capable': row['imessage'],
+                    'rcs_capable': row['rcs'],
+                    'email_enabled': row['email'],
+                    'phone_enabled': row['phone']
                 }
         except Exception as e:
-            logging.error(f"Error getting contact stats: {e}")
+            logging.error("Error getting contact stats: %s", e)
             return {}
 
 
-# Global contact manager instance
-contact_manager = ContactManager()
+# Global contact manager instance, opened on first use so importing this
+# module does not touch the database
+_contact_manager: Optional[ContactManager] = None
+_init_lock = threading.Lock()
+
+
+def get_contact_manager() -> ContactManager:
+    """
+    Get the shared contact manager, creating it on first call
+    """
+    global _contact_manager
+    if _contact_manager is None:
+        with _init_lock:
+            if _contact_manager is None:
+                _contact_manager = ContactManager()
+    return _contact_manager
 
 
 # Functions to interact with the contact manager
@@ -437,24 +755,25 @@ def get_contact_for_sending(to_identifier: str) -> Optional[Contact]:
     """
     Get a contact by phone number or email for message sending
     """
-    # Try to find by phone first
-    contact = contact_manager.get_contact_by_phone(to_identifier)
+    return get_contact_manager().get_contact_by_identifier(to_identifier)
 
-    if not contact:
-        # Then try by email
-        contact = contact_manager.get_contact_by_email(to_identifier)
 
-    return contact
+def get_contact_hint_for_sending(to_identifier: str) -> Optional[ContactHint]:
+    """
+    Get the routing fields of a contact by phone number or email
+    Cheaper than get_contact_for_sending when name, tags and dates are not needed
+    """
+    return get_contact_manager().get_channel_hint_by_identifier(to_identifier)
 
 
 def record_message_sent(contact_id: str):
     """
     Record that a message was sent to a contact
     """
-    contact_manager.increment_message_count(contact_id)
+    get_contact_manager().increment_message_count(contact_id)
 
 
-def is_contact_opted_in(contact: Contact) -> bool:
+def is_contact_opted_in(contact: Union[Contact, ContactHint]) -> bool:
     """
     Check if a contact has opted in to receive messages
     """
@@ -463,13 +782,13 @@ def is_contact_opted_in(contact: Contact) -> bool:
     return contact.opt_in and not contact.blocked
 
 
-def get_best_channel_for_contact(contact: Contact) -> str:
+def get_best_channel_for_contact(contact: Union[Contact, ContactHint]) -> str:
     """
     Determine the best channel to use for contacting someone
     """
     if contact is None:
         return "sms"  # Default fallback
-    preferred = contact_manager.get_preferred_channel(contact)
+    preferred = get_contact_manager().get_preferred_channel(contact)
     return preferred.value
 
 
@@ -479,7 +798,7 @@ def get_fallback_channels_for_contact(contact: Contact) -> List[str]:
     """
     if contact is None:
         return ["sms", "email"]  # Default fallbacks
-    fallbacks = contact_manager.get_fallback_channels(contact)
+    fallbacks = get_contact_manager().get_fallback_channels(contact)
     return [fb.value for fb in fallbacks]
 
 
@@ -501,6 +820,7 @@ if __name__ == "__main__":
     )
 
     # Add to contact manager
+    contact_manager = get_contact_manager()
     success = contact_manager.add_contact(sample_contact)
     print(f"Contact added: {success}")
 
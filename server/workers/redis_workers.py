@@ -1,30 +1,146 @@
 import redis.asyncio as redis
+from redis.exceptions import NoScriptError, WatchError
 import asyncio
+from collections import deque
 import uuid
+import hashlib
+import secrets
 import json
 import logging
-from datetime import datetime, timedelta
+import time
+import random
+from datetime import datetime
+import msgpack
 from typing import Dict, Optional, List, Tuple
-from ..models.routing_state_machine import Message, MessageState, transition, send_via_channel, human_delay
+from ..models.routing_state_machine import (
+    Message, MessageState, SendError, transition, send_via_channel, human_delay_seconds, retry_delay,
+    classify_error, state_name, parse_state, receipt_seen, HUMAN_DELAY_MAX
+)
+
+
+# Every LuaScript defined in this module, preloaded by load_scripts
+_scripts: List["LuaScript"] = []
+
+
+class LuaScript:
+    """
+    Lua script hashed once when defined
+    Runs with EVALSHA, sending the source with EVAL only if Redis does not
+    have the script cached
+    """
+
+    def __init__(self, source: str):
+        self.source = source
+        self.sha = hashlib.sha1(source.encode()).hexdigest()
+        _scripts.append(self)
+
+    async def __call__(self, client, keys: List[object], args: List[object]):
+        try:
+            return await client.evalsha(self.sha, len(keys), *keys, *args)
+        except NoScriptError:
+            return await client.eval(self.source, len(keys), *keys, *args)
+
+
+async def load_scripts(client):
+    """
+    Cache every worker script in Redis in one round-trip
+    Run once per client at worker start, so pipelined EVALSHA calls find them
+    """
+    pipe = client.pipeline(transaction=False)
+    for script in _scripts:
+        pipe.script_load(script.source)
+    await pipe.execute()
+
+
+class CoalescedRedis:
+    """
+    Write buffer over a non-transactional pipeline
+    Queued writes are sent together once max_pending commands are buffered or
+    flush_delay seconds after the first one, whichever comes first
+    """
+
+    def __init__(self, client, max_pending: int = 32, flush_delay: float = 0.002):
+        self.client = client
+        self.max_pending = max_pending
+        self.flush_delay = flush_delay
+        self._pipe = client.pipeline(transaction=False)
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+
+    async def set(self, name: str, value: bytes, **kwargs):
+        """Queue a SET"""
+        self._pipe.set(name, value, **kwargs)
+        await self._written()
+
+    async def run_script(self, script: LuaScript, keys: List[object], args: List[object]):
+        """Run a registered script together with the buffered writes"""
+        self._pipe.evalsha(script.sha, len(keys), *keys, *args)
+        try:
+            await self.flush()
+        except NoScriptError:
+            # The other buffered commands were applied; only the script needs loading
+            await script(self.client, keys, args)
+
+    async def _written(self):
+        if len(self._pipe.command_stack) >= self.max_pending:
+            await self.flush()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.flush_delay)
+        self._flush_task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logging.error(f"Error flushing buffered Redis writes: {e}")
+
+    async def flush(self):
+        """Send all buffered writes in one round-trip"""
+        if self._flush_task is not None and self._flush_task is not asyncio.current_task():
+            self._flush_task.cancel()
+            self._flush_task = None
+        pipe, self._pipe = self._pipe, self.client.pipeline(transaction=False)
+        if not pipe.command_stack:
+            return
+        # Serialize flushes so buffered writes reach Redis in order
+        async with self._flush_lock:
+            await pipe.execute()
 
 
 class RedisClient:
-    def __init__(self, host="localhost", port=6379, db=0, password=None, ssl=False):
-        self.client = redis.Redis(
+    def __init__(self, host="localhost", port=6379, db=0, password=None, ssl=False,
+                 max_connections=16, pool_timeout=5):
+        # One capped pool shared by every worker; callers wait for a free
+        # connection instead of opening new ones. Each worker holds at most one
+        # blocking pop plus the write buffer's flush at a time.
+        pool = redis.BlockingConnectionPool(
+            max_connections=max_connections,
+            timeout=pool_timeout,
+            connection_class=redis.SSLConnection if ssl else redis.Connection,
             host=host,
             port=port,
             db=db,
             password=password,
-            ssl=ssl,
-            decode_responses=True,
+            # Hash values are decoded field by field in _parse_message and
+            # state blobs are msgpack
+            decode_responses=False,
             socket_keepalive=True,
             socket_keepalive_options={},
             health_check_interval=30
         )
+        self.client = redis.Redis(connection_pool=pool)
+        self._writer: Optional[CoalescedRedis] = None
 
     async def get_client(self):
         return self.client
 
+    def get_writer(self) -> CoalescedRedis:
+        """Write buffer shared by the workers on this client"""
+        if self._writer is None or self._writer.client is not self.client:
+            self._writer = CoalescedRedis(self.client)
+        return self._writer
+
     async def test_connection(self) -> bool:
         """Test Redis connection"""
         try:
@@ -39,28 +155,177 @@ class RedisClient:
 # Global Redis client instance
 redis_client = RedisClient()
 
+# Sorted set of message ids waiting to be sent, scored by send_score();
+# an entry is due once its score is at or below the current time
+SEND_QUEUE = "queue:send:z"
+
+# The list the send queue used to be; ids left in it are moved over by
+# migrate_legacy_send_queue
+LEGACY_SEND_QUEUE = "queue:send"
+
+# Seconds of queueing head start each priority level gives a due message
+PRIORITY_BONUS = 10.0
 
-async def acquire_lock(redis_conn, key: str, ttl: int = 30) -> bool:
+# Longest the scheduler sleeps when only future retries are queued, so
+# newly enqueued messages are still picked up promptly
+MAX_IDLE_WAIT = 1.0
+
+# Key prefixes, kept as bytes since the client does not decode responses
+MSG_PREFIX = b"msg:"
+STATE_SUFFIX = b":state"
+LOCK_PREFIX = b"lock:msg:"
+FALLBACK_LOCK_PREFIX = b"fallback-lock:"
+
+# Seconds a fallback reroute holds its single-flight lock
+FALLBACK_LOCK_TTL = 10
+
+# Seconds the scheduler blocks on an empty send queue; long waits keep Redis
+# from spending CPU expiring blocked clients that have nothing to do anyway
+BRPOP_TIMEOUT = 30
+
+# Seconds the scheduler holds a message lock while sending it
+SEND_LOCK_TTL = 60
+
+# Maximum number of message ids popped from the send queue per round-trip.
+# A batch is locked at once and sent one message at a time after a human
+# delay each, so the whole batch must fit well inside SEND_LOCK_TTL; half of
+# it leaves headroom for the sends themselves
+DEQUEUE_BATCH_SIZE = max(1, int(SEND_LOCK_TTL // (2 * HUMAN_DELAY_MAX)))
+
+# Queue of sent message ids awaiting delivery confirmation
+CONFIRM_QUEUE = "queue:confirm"
+
+# Maximum number of message ids popped from the confirm queue and checked at once
+CONFIRM_BATCH_SIZE = 16
+
+# Seconds a receipt check may take before the message is treated as timed out
+RECEIPT_TIMEOUT = 2
+
+# Seconds a message is kept before Redis expires it
+MESSAGE_TTL = 24 * 3600
+
+
+def send_score(priority: int, ready_at: float, now: float) -> float:
+    """
+    Score of a message in the send queue, in epoch seconds
+    A message scheduled for later scores its ready time, so it cannot be popped early;
+    a due message is moved ahead by PRIORITY_BONUS seconds per priority level
+    """
+    if ready_at > now:
+        return ready_at
+    return ready_at - priority * PRIORITY_BONUS
+
+
+def _msg_key(msg_id: str) -> bytes:
+    return MSG_PREFIX + msg_id.encode()
+
+
+def _state_key(msg_id: str) -> bytes:
+    return MSG_PREFIX + msg_id.encode() + STATE_SUFFIX
+
+
+def _fallbacks_key(msg_id: str) -> bytes:
+    return MSG_PREFIX + msg_id.encode() + b":fallbacks"
+
+
+def _lock_key(msg_id: str) -> bytes:
+    return LOCK_PREFIX + msg_id.encode()
+
+
+def new_lock_token() -> str:
+    """
+    Random value identifying one lock holder
+    """
+    return secrets.token_hex(8)
+
+
+async def acquire_lock(redis_conn, key, ttl: int = 30) -> Optional[str]:
     """
     Acquire a distributed lock using Redis
+    Returns the token to release it with, or None if the lock is held elsewhere
     """
     try:
-        return await redis_conn.set(key, "1", ex=ttl, nx=True)
+        token = new_lock_token()
+        if await redis_conn.set(key, token, ex=ttl, nx=True):
+            return token
+        return None
     except Exception as e:
         logging.error(f"Failed to acquire lock {key}: {e}")
-        return False
+        return None
+
+
+# Sets a lock key per id with SET NX EX and returns the ids that were acquired
+# KEYS: lock keys; ARGV[1]: token, ARGV[2]: ttl, ARGV[3..]: ids matching KEYS
+_ACQUIRE_LOCKS_SCRIPT = LuaScript("""
+local acquired = {}
+for i, key in ipairs(KEYS) do
+    if redis.call('SET', key, ARGV[1], 'NX', 'EX', ARGV[2]) then
+        acquired[#acquired + 1] = ARGV[i + 2]
+    end
+end
+return acquired
+""")
+
+
+async def acquire_locks(redis_conn, msg_ids: List[str], token: str, ttl: int = 30) -> List[str]:
+    """
+    Acquire the message locks of several ids with one token in one round-trip
+    Returns the ids whose lock was acquired
+    """
+    if not msg_ids:
+        return []
+    try:
+        acquired = await _ACQUIRE_LOCKS_SCRIPT(redis_conn, [_lock_key(msg_id) for msg_id in msg_ids], [token, ttl, *msg_ids])
+        return [msg_id.decode() for msg_id in acquired]
+    except Exception as e:
+        logging.error(f"Failed to acquire locks for {len(msg_ids)} messages: {e}")
+        return []
+
+
+# Deletes KEYS[1] only if it still holds the token ARGV[1]
+_RELEASE_LOCK_SCRIPT = LuaScript("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
 
 
-async def release_lock(redis_conn, key: str):
+async def release_lock(redis_conn, key, token: str):
     """
     Release a distributed lock
+    Does nothing if the lock expired and was taken by another holder
     """
     try:
-        await redis_conn.delete(key)
+        await _RELEASE_LOCK_SCRIPT(redis_conn, [key], [token])
     except Exception as e:
         logging.error(f"Failed to release lock {key}: {e}")
 
 
+# Deletes each of KEYS that still holds the token ARGV[1]
+_RELEASE_LOCKS_SCRIPT = LuaScript("""
+for _, key in ipairs(KEYS) do
+    if redis.call('GET', key) == ARGV[1] then
+        redis.call('DEL', key)
+    end
+end
+return 1
+""")
+
+
+async def release_locks(redis_conn, msg_ids: List[str], token: str):
+    """
+    Release the message locks of several ids taken with one token
+    Sent together with any buffered writes, so those land before the locks go
+    """
+    if not msg_ids:
+        return
+    try:
+        await redis_client.get_writer().run_script(_RELEASE_LOCKS_SCRIPT, [_lock_key(msg_id) for msg_id in msg_ids], [token])
+    except Exception as e:
+        logging.error(f"Failed to release locks for {len(msg_ids)} messages: {e}")
+
+
 async def enqueue_message(to: str, text: str, channel: str, fallback_channels: List[str] = None, priority: int = 1) -> str:
     """
     Enqueue a message in Redis with initial state
@@ -69,34 +334,33 @@ async def enqueue_message(to: str, text: str, channel: str, fallback_channels: L
         fallback_channels = []
 
     msg_id = str(uuid.uuid4())
+    now = time.time()
 
-    # Store message data in Redis hash
+    # Store the fixed message data in a Redis hash
     message_data = {
         "id": msg_id,
         "to": to,
         "text": text,
         "channel": channel,
-        "state": MessageState.QUEUED.value,
-        "attempts": 0,
-        "fallback_channels": ",".join(fallback_channels),
-        "created_at": datetime.now().isoformat(),
-        "priority": priority,
-        "expires_at": (datetime.now() + timedelta(hours=24)).isoformat()  # Expires in 24 hours
+        "created_at": now,
+        "priority": priority
     }
+    state = {"state": state_name(MessageState.QUEUED), "attempts": 0, "channel": channel}
 
     client = await redis_client.get_client()
     pipe = client.pipeline()
 
-    # Store message data
-    pipe.hset(f"msg:{msg_id}", mapping=message_data)
+    # Store message data, its state and fallbacks; Redis deletes them all once they expire
+    expires_at = int(now) + MESSAGE_TTL
+    pipe.hset(_msg_key(msg_id), mapping=message_data)
+    pipe.expireat(_msg_key(msg_id), expires_at)
+    pipe.set(_state_key(msg_id), msgpack.packb(state), exat=expires_at)
+    if fallback_channels:
+        pipe.rpush(_fallbacks_key(msg_id), *fallback_channels)
+        pipe.expireat(_fallbacks_key(msg_id), expires_at)
 
-    # Add to send queue with priority consideration
-    if priority > 1:
-        # Higher priority messages go to the front of the queue
-        pipe.lpush("queue:send", msg_id)
-    else:
-        # Normal priority messages go to the back
-        pipe.rpush("queue:send", msg_id)
+    # Add to send queue, due now and ordered by priority then enqueue time
+    pipe.zadd(SEND_QUEUE, {msg_id: send_score(priority, now, now)})
 
     # Execute pipeline
     await pipe.execute()
@@ -105,199 +369,492 @@ async def enqueue_message(to: str, text: str, channel: str, fallback_channels: L
     return msg_id
 
 
-async def get_message(msg_id: str) -> Optional[Message]:
+def _parse_message(data: Dict[bytes, bytes], state: Optional[bytes] = None) -> Message:
+    """
+    Convert a message hash and its packed state read from Redis to a Message object
+    Only string fields are decoded; numbers are parsed from the raw bytes
+    """
+    msg_id = data[b'id'].decode()
+    channel = data.get(b'channel')
+    msg = Message(
+        id=msg_id,
+        to=data[b'to'].decode(),
+        text=data[b'text'].decode(),
+        channel=channel.decode() if channel is not None else None
+    )
+
+    # Set priority
+    if b'priority' in data:
+        try:
+            msg.priority = int(data[b'priority'])
+        except ValueError:
+            msg.priority = 1
+
+    # Set timestamps, stored as epoch seconds
+    if data.get(b'created_at'):
+        msg.created_at = _parse_timestamp(data[b'created_at'])
+
+    if state is not None:
+        _apply_state(msg, msgpack.unpackb(state))
+    else:
+        # Written before state moved to its own key
+        _apply_state(msg, _legacy_state(data))
+
+    return msg
+
+
+def _parse_timestamp(raw: bytes) -> float:
+    """
+    Parse a stored timestamp as epoch seconds
+    Older messages stored ISO 8601 strings
+    """
+    try:
+        return float(raw)
+    except ValueError:
+        return datetime.fromisoformat(raw.decode()).timestamp()
+
+
+def _legacy_state(data: Dict[bytes, bytes]) -> Dict[str, object]:
+    """
+    Read the state of a message hash that still carries its state fields
+    A hash without a state field was enqueued and is treated as queued
+    """
+    state: Dict[str, object] = {"state": data.get(b'state', b'queued').decode()}
+    try:
+        state["attempts"] = int(data.get(b'attempts', 0))
+    except ValueError:
+        state["attempts"] = 0
+    if data.get(b'last_error_code'):
+        try:
+            state["last_error_code"] = int(data[b'last_error_code'])
+        except ValueError:
+            state["last_error_code"] = int(SendError.UNKNOWN)
+    for field in ("sent_at", "confirmed_at", "retry_after"):
+        raw = data.get(field.encode())
+        if raw:
+            state[field] = _parse_timestamp(raw)
+    return state
+
+
+def _pack_state(msg: Message) -> bytes:
+    """
+    Serialize the mutable fields of a message
+    """
+    return msgpack.packb({
+        "state": state_name(msg.state),
+        "attempts": msg.attempts,
+        "channel": msg.channel,
+        "last_error_code": int(msg.last_error_code) if msg.last_error_code is not None else None,
+        "sent_at": msg.sent_at,
+        "confirmed_at": msg.confirmed_at,
+        "retry_after": msg.retry_after
+    })
+
+
+def _apply_state(msg: Message, state: Dict[str, object]):
+    """
+    Set the mutable fields of a message from its unpacked state
+    """
+    try:
+        msg.state = parse_state(state["state"])
+    except (KeyError, ValueError):
+        logging.warning(f"Invalid state {state.get('state')} for message {msg.id}, using default")
+        msg.state = MessageState.QUEUED
+
+    msg.attempts = state.get("attempts", 0)
+    msg.channel = state.get("channel", msg.channel)
+
+    error_code = state.get("last_error_code")
+    if error_code is not None:
+        try:
+            msg.last_error_code = SendError(error_code)
+        except ValueError:
+            msg.last_error_code = SendError.UNKNOWN
+
+    msg.sent_at = state.get("sent_at")
+    msg.confirmed_at = state.get("confirmed_at")
+    msg.retry_after = state.get("retry_after")
+
+
+async def get_message(msg_id: str, with_fallbacks: bool = False) -> Optional[Message]:
     """
     Retrieve a message from Redis and convert to Message object
     """
+    messages = await get_messages([msg_id], with_fallbacks)
+    return messages[0] if messages else None
+
+
+async def get_messages(msg_ids: List[str], with_fallbacks: bool = False) -> List[Optional[Message]]:
+    """
+    Retrieve several messages from Redis in a single round-trip
+    Returns one entry per id, None where the message is missing or has expired.
+    Remaining fallback channels are only read with with_fallbacks; fallback_worker
+    pops them from Redis directly.
+    """
+    if not msg_ids:
+        return []
+
     try:
         client = await redis_client.get_client()
-        data = await client.hgetall(f"msg:{msg_id}")
 
-        if not data or 'id' not in data:
-            logging.warning(f"Message {msg_id} not found in Redis")
-            return None
-
-        # Check if message has expired
-        if 'expires_at' in data:
-            from datetime import datetime
-            expires_at = datetime.fromisoformat(data['expires_at'])
-            if datetime.now() > expires_at:
-                logging.info(f"Message {msg_id} has expired, removing from queue")
-                await client.delete(f"msg:{msg_id}")
-                return None
-
-        msg = Message(
-            id=data['id'],
-            to=data['to'],
-            text=data['text'],
-            channel=data.get('channel')
-        )
+        pipe = client.pipeline(transaction=False)
+        for msg_id in msg_ids:
+            pipe.hgetall(_msg_key(msg_id))
+            pipe.get(_state_key(msg_id))
+            if with_fallbacks:
+                pipe.lrange(_fallbacks_key(msg_id), 0, -1)
+        replies = await pipe.execute()
+        if not with_fallbacks:
+            return _load_messages(msg_ids, replies[::2], replies[1::2])
+
+        messages = _load_messages(msg_ids, replies[::3], replies[1::3])
+        for msg, channels in zip(messages, replies[2::3]):
+            if msg:
+                msg.fallback_channels = deque(channel.decode() for channel in channels)
+        return messages
+    except Exception as e:
+        logging.error(f"Error retrieving messages {msg_ids} from Redis: {e}")
+        return [None] * len(msg_ids)
 
-        # Set state
-        if 'state' in data:
-            try:
-                msg.state = MessageState(data['state'])
-            except ValueError:
-                logging.warning(f"Invalid state {data['state']} for message {msg_id}, using default")
-                msg.state = MessageState.QUEUED
 
-        # Set attempts
-        if 'attempts' in data:
+def _load_messages(msg_ids: List[str], hashes: List[Dict[bytes, bytes]],
+                   states: List[Optional[bytes]]) -> List[Optional[Message]]:
+    """
+    Parse message hashes and packed states read for msg_ids
+    An empty hash means the message is gone, usually because its key expired
+    """
+    messages: List[Optional[Message]] = []
+    for msg_id, data, state in zip(msg_ids, hashes, states):
+        if not data or b'id' not in data:
+            logging.warning(f"Message {msg_id} not found in Redis")
+            messages.append(None)
+        else:
             try:
-                msg.attempts = int(data['attempts'])
-            except ValueError:
-                msg.attempts = 0
+                messages.append(_parse_message(data, state))
+            except Exception as e:
+                logging.error(f"Error parsing message {msg_id} from Redis: {e}")
+                messages.append(None)
 
-        # Set fallback channels
-        if 'fallback_channels' in data and data['fallback_channels']:
-            msg.fallback_channels = data['fallback_channels'].split(',')
+    return messages
 
-        # Set error if present
-        if 'last_error' in data:
-            msg.last_error = data['last_error']
 
-        # Set priority
-        if 'priority' in data:
+async def migrate_legacy_send_queue(client) -> int:
+    """
+    Move ids still queued in the pre-sorted-set send list onto SEND_QUEUE
+    Legacy message hashes were written without a TTL: each gets EXPIREAT from
+    its expires_at field (MESSAGE_TTL from now without one), and messages
+    already past it are dropped instead of queued. Comma-joined fallback
+    channels move to the fallbacks list. Runs atomically, so it is
+    safe on every start and from several workers at once; returns the number
+    of ids moved
+    """
+    async with client.pipeline(transaction=True) as pipe:
+        while True:
             try:
-                msg.priority = int(data['priority'])
-            except ValueError:
-                msg.priority = 1
+                await pipe.watch(LEGACY_SEND_QUEUE)
+                if await pipe.type(LEGACY_SEND_QUEUE) != b"list":
+                    return 0
+
+                # Oldest first; the list was served from its right end
+                msg_ids = (await pipe.lrange(LEGACY_SEND_QUEUE, 0, -1))[::-1]
+                reads = client.pipeline(transaction=False)
+                for msg_id in msg_ids:
+                    reads.hmget(MSG_PREFIX + msg_id, "id", "expires_at", "fallback_channels")
+                hashes = await reads.execute()
+
+                now = time.time()
+                queued: Dict[bytes, float] = {}
+                pipe.multi()
+                for msg_id, (stored_id, expires_at, fallbacks) in zip(msg_ids, hashes):
+                    if stored_id is None:
+                        continue  # Hash already gone
+                    expires_at = _parse_timestamp(expires_at) if expires_at else now + MESSAGE_TTL
+                    # A time in the past deletes the hash right away
+                    pipe.expireat(MSG_PREFIX + msg_id, int(expires_at))
+                    if expires_at > now:
+                        # Due now, in the order the list would have served them
+                        queued[msg_id] = now + len(queued) * 1e-6
+                        if fallbacks:
+                            fallbacks_key = _fallbacks_key(msg_id.decode())
+                            pipe.delete(fallbacks_key)
+                            pipe.rpush(fallbacks_key, *fallbacks.split(b","))
+                            pipe.expireat(fallbacks_key, int(expires_at))
+                if queued:
+                    pipe.zadd(SEND_QUEUE, queued, nx=True)
+                pipe.delete(LEGACY_SEND_QUEUE)
+                await pipe.execute()
+                break
+            except WatchError:
+                continue  # The list changed under us; read it again
+
+    logging.info(f"Moved {len(queued)} of {len(msg_ids)} messages from the legacy send list "
+                 f"to the send queue, dropping the rest as expired or missing")
+    return len(queued)
+
+
+async def requeue_message(client, msg: Message):
+    """
+    Put a message back on the send queue, honoring its priority and retry_after
+    """
+    # Buffered state writes must land before another worker can pop the id
+    await redis_client.get_writer().flush()
+    now = time.time()
+    await client.zadd(SEND_QUEUE, {msg.id: send_score(msg.priority, msg.retry_after or now, now)})
 
-        # Set expiration time
-        if 'expires_at' in data:
-            try:
-                from datetime import datetime
-                msg.expires_at = datetime.fromisoformat(data['expires_at']).timestamp()
-            except ValueError:
-                pass
 
-        return msg
-    except Exception as e:
-        logging.error(f"Error retrieving message {msg_id} from Redis: {e}")
-        return None
+# Cleared the first time the server rejects BZMPOP (Redis < 7)
+_bzmpop_supported = True
+
+
+async def dequeue_batch(client, count: int = DEQUEUE_BATCH_SIZE,
+                        timeout: Optional[int] = BRPOP_TIMEOUT) -> List[str]:
+    """
+    Pop up to `count` due message ids from the send queue in a single round-trip
+    Blocks for up to `timeout` seconds when the queue is empty, or not at all if None.
+    Entries popped before they are due are put back with their score.
+    """
+    global _bzmpop_supported
+    popped = None
+    if _bzmpop_supported and timeout is not None:
+        try:
+            result = await client.execute_command("BZMPOP", timeout, 1, SEND_QUEUE, "MIN", "COUNT", count)
+        except redis.ResponseError as e:
+            if "unknown command" not in str(e).lower():
+                raise
+            logging.info("BZMPOP unavailable, falling back to ZPOPMIN/BZPOPMIN")
+            _bzmpop_supported = False
+        else:
+            if not result:
+                return []
+            _, popped = result  # bzmpop returns (key, [(member, score), ...])
+
+    if popped is None:
+        popped = await client.zpopmin(SEND_QUEUE, count)
+        if not popped and timeout is not None:
+            # Queue is empty, block until something arrives
+            result = await client.bzpopmin(SEND_QUEUE, timeout=timeout)
+            if result:
+                _, msg_id, score = result  # bzpopmin returns (key, member, score)
+                popped = [(msg_id, score)]
+
+    now = time.time()
+    not_due = {msg_id: float(score) for msg_id, score in popped if float(score) > now}
+    if not_due:
+        await client.zadd(SEND_QUEUE, not_due)
+    return [msg_id.decode() for msg_id, score in popped if msg_id not in not_due]
+
+
+# Takes up to ARGV[1] ids scored at or below ARGV[3] (now) from the send queue,
+# locking each with token ARGV[4] for ARGV[2] seconds; ids locked elsewhere stay queued.
+# Returns {{id, HGETALL, packed state} triples, next score, contended count}, where next score is
+# the head of the queue if nothing was due
+# KEYS[1]: send queue; ARGV[5..7]: MSG_PREFIX, LOCK_PREFIX, STATE_SUFFIX
+_FETCH_SEND_SCRIPT = LuaScript("""
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[3], 'LIMIT', 0, ARGV[1])
+if #due == 0 then
+    local head = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    return {{}, head[2] or false, 0}
+end
+local fetched = {}
+local contended = 0
+for _, id in ipairs(due) do
+    if redis.call('SET', ARGV[6] .. id, ARGV[4], 'NX', 'EX', ARGV[2]) then
+        redis.call('ZREM', KEYS[1], id)
+        local key = ARGV[5] .. id
+        fetched[#fetched + 1] = {id, redis.call('HGETALL', key), redis.call('GET', key .. ARGV[7])}
+    else
+        contended = contended + 1
+    end
+end
+return {fetched, false, contended}
+""")
+
+# Writes a message's state, hands it to the next queue and releases its lock
+# if it still holds the caller's token
+# KEYS[1]: message state key, KEYS[2]: lock key, KEYS[3]: next queue (optional)
+# ARGV[1]: id, ARGV[2]: send queue score, or "" to LPUSH onto a list,
+# ARGV[3]: lock token, ARGV[4]: packed state
+_COMPLETE_SEND_SCRIPT = LuaScript("""
+redis.call('SET', KEYS[1], ARGV[4], 'KEEPTTL')
+if KEYS[3] then
+    if ARGV[2] ~= '' then
+        redis.call('ZADD', KEYS[3], ARGV[2], ARGV[1])
+    else
+        redis.call('LPUSH', KEYS[3], ARGV[1])
+    end
+end
+if redis.call('GET', KEYS[2]) == ARGV[3] then
+    redis.call('DEL', KEYS[2])
+end
+return 1
+""")
 
 
 async def update_message(msg: Message):
     """
     Update message state in Redis
+    The write is buffered (see CoalescedRedis) and sent with the next flush
     """
     try:
-        client = await redis_client.get_client()
-
-        await client.hset(f"msg:{msg.id}", mapping={
-            "state": msg.state.value,
-            "attempts": msg.attempts,
-            "channel": msg.channel or "",
-            "last_error": msg.last_error or "",
-            "sent_at": msg.sent_at or "",
-            "confirmed_at": msg.confirmed_at or "",
-            "retry_after": msg.retry_after or ""
-        })
+        await redis_client.get_writer().set(_state_key(msg.id), _pack_state(msg), keepttl=True)
     except Exception as e:
         logging.error(f"Error updating message {msg.id} in Redis: {e}")
 
 
-async def send_worker():
+async def fetch_send_batch(client, count: int = DEQUEUE_BATCH_SIZE,
+                           timeout: Optional[int] = BRPOP_TIMEOUT) -> Tuple[List[Tuple[str, Optional[Message], str]], int]:
     """
-    Async worker to process messages from the send queue
+    Pop, lock and load up to `count` due messages from the send queue
+    Returns (id, message, lock token) for each locked message, and the number of
+    due ids left queued because another worker holds their lock.
+    Due messages are served by one script call. If only future retries are queued
+    this waits until the first is due (at most MAX_IDLE_WAIT) and returns nothing;
+    an empty queue falls back to a blocking pop (see dequeue_batch) followed by
+    lock and load round-trips.
     """
-    logging.info("Send worker started")
+    token = new_lock_token()
+    now = time.time()
+    fetched, next_score, contended = await _FETCH_SEND_SCRIPT(
+        client, [SEND_QUEUE], [count, SEND_LOCK_TTL, now, token, MSG_PREFIX, LOCK_PREFIX, STATE_SUFFIX]
+    )
+    if fetched or contended:
+        msg_ids = [msg_id.decode() for msg_id, _, _ in fetched]
+        hashes = [dict(zip(fields[::2], fields[1::2])) for _, fields, _ in fetched]
+        states = [state for _, _, state in fetched]
+        messages = _load_messages(msg_ids, hashes, states)
+        return [(msg_id, msg, token) for msg_id, msg in zip(msg_ids, messages)], contended
+
+    if next_score is not None:
+        if timeout is not None:
+            await asyncio.sleep(min(float(next_score) - now, MAX_IDLE_WAIT, timeout))
+        return [], 0
+
+    msg_ids = await dequeue_batch(client, count, timeout)
+    locked = await acquire_locks(client, msg_ids, token, ttl=SEND_LOCK_TTL)
+    if len(locked) < len(msg_ids):
+        # Another worker holds these; put them back rather than dropping them
+        skipped = set(msg_ids).difference(locked)
+        await client.zadd(SEND_QUEUE, {msg_id: time.time() for msg_id in skipped})
+    batch = [(msg_id, msg, token) for msg_id, msg in zip(locked, await get_messages(locked))]
+    return batch, len(msg_ids) - len(locked)
+
+
+async def complete_send(client, msg: Message, token: str, next_queue: Optional[str] = None):
+    """
+    Persist a message's state, push it onto next_queue and release its lock
+    in a single script call, sent together with any buffered writes
+    """
+    keys = [_state_key(msg.id), _lock_key(msg.id)]
+    score = ""
+    if next_queue:
+        keys.append(next_queue)
+        if next_queue == SEND_QUEUE:
+            now = time.time()
+            score = send_score(msg.priority, msg.retry_after or now, now)
 
-    while True:
-        try:
-            client = await redis_client.get_client()
+    args = [msg.id, score, token, _pack_state(msg)]
 
-            # Block for up to 5 seconds waiting for a message
-            result = await client.brpop("queue:send", timeout=5)
+    await redis_client.get_writer().run_script(_COMPLETE_SEND_SCRIPT, keys, args)
 
-            if not result:
-                # Timeout occurred, continue loop
-                continue
 
-            _, msg_id = result  # brpop returns (key, value)
+async def process_send_message(client, msg: Message, token: str) -> bool:
+    """
+    Send a single message popped from the send queue
+    The caller must hold the message's lock under `token`; it is released once
+    the message is handled.
+    Returns False if the message was put back because it is not yet due for retry
+    """
+    try:
+        # Check if message should be retried based on retry_after timestamp
+        if msg.retry_after and msg.retry_after > time.time():
+            # Put message back in queue for later processing
+            await complete_send(client, msg, token, SEND_QUEUE)
+            return False
 
-            # Acquire lock to prevent duplicate processing
-            lock_key = f"lock:msg:{msg_id}"
-            acquired = await acquire_lock(client, lock_key, ttl=60)
+        # Update state to sending
+        if transition(msg, "send"):
+            await update_message(msg)
 
-            if not acquired:
-                logging.warning(f"Could not acquire lock for message {msg_id}, skipping")
-                continue
+        # Add human-like delay without stalling the other work on the loop
+        await asyncio.sleep(human_delay_seconds())
 
-            try:
-                # Get message from Redis
-                msg = await get_message(msg_id)
+        next_queue = None
 
-                if not msg:
-                    logging.warning(f"Message {msg_id} not found in Redis after lock acquisition")
-                    continue
+        # Attempt to send via channel
+        try:
+            send_via_channel(msg)
+            if transition(msg, "success"):
+                logging.info(f"Message {msg.id} sent successfully via {msg.channel}")
+        except Exception as e:
+            msg.last_error_code = classify_error(e)
+            msg.attempts += 1
+            logging.error("Failed to send message %s via %s: %s. Attempt %d/%d",
+                          msg.id, msg.channel, e, msg.attempts, msg.max_attempts)
+            transition(msg, "error")
+
+            if msg.attempts < msg.max_attempts:
+                if transition(msg, "retry"):
+                    # Re-queue for retry after delay
+                    msg.retry_after = time.time() + retry_delay(msg.attempts)
+                    next_queue = SEND_QUEUE
+            else:
+                if transition(msg, "fallback"):
+                    await update_message(msg)
 
-                # Check if message should be retried based on retry_after timestamp
-                if msg.retry_after and msg.retry_after > time.time():
-                    # Put message back in queue for later processing
-                    await client.lpush("queue:send", msg_id)
-                    continue
+                    # Reroute to the next fallback channel, or mark as failed if none is left
+                    await fallback_worker(msg)
 
-                # Update state to sending
-                if transition(msg, "send"):
-                    await update_message(msg)
+        # If successful, move to confirmation queue
+        if msg.state == MessageState.SENT:
+            next_queue = CONFIRM_QUEUE
 
-                # Add human-like delay
-                human_delay()
-
-                # Attempt to send via channel
-                try:
-                    send_via_channel(msg)
-                    if transition(msg, "success"):
-                        await update_message(msg)
-                        logging.info(f"Message {msg.id} sent successfully via {msg.channel}")
-                except Exception as e:
-                    msg.last_error = str(e)
-                    msg.attempts += 1
-                    logging.error(f"Failed to send message {msg.id} via {msg.channel}: {str(e)}. Attempt {msg.attempts}/{msg.max_attempts}")
-
-                    if msg.attempts < msg.max_attempts:
-                        if transition(msg, "retry"):
-                            # Re-queue for retry after delay
-                            msg.retry_after = time.time() + (30 * msg.attempts)  # Exponential backoff
-                            await update_message(msg)
-                            await client.lpush("queue:send", msg_id)
-                    else:
-                        if transition(msg, "fallback"):
-                            await update_message(msg)
-
-                            # Move to fallback queue if fallback channels available
-                            if msg.fallback_channels:
-                                await fallback_worker(msg)
-                            else:
-                                # No fallback options, mark as failed
-                                msg.state = MessageState.FAILED
-                                await update_message(msg)
-                                logging.warning(f"Message {msg.id} failed after all attempts and fallbacks")
-
-                # Update message state in Redis
-                await update_message(msg)
+        # Update message state in Redis, hand off and unlock
+        await complete_send(client, msg, token, next_queue)
+        if next_queue == CONFIRM_QUEUE:
+            logging.info(f"Message {msg.id} moved to confirmation queue")
 
-                # If successful, move to confirmation queue
-                if msg.state == MessageState.SENT:
-                    await client.lpush("queue:confirm", msg_id)
-                    logging.info(f"Message {msg.id} moved to confirmation queue")
+    except Exception as e:
+        logging.error(f"Error processing message {msg.id} in scheduler: {e}")
+        await release_lock(client, _lock_key(msg.id), token)
 
-            except Exception as e:
-                logging.error(f"Error processing message {msg_id} in send_worker: {e}")
-            finally:
-                # Always release the lock
-                await release_lock(client, lock_key)
+    return True
 
-        except asyncio.CancelledError:
-            logging.info("Send worker cancelled")
-            break
-        except KeyboardInterrupt:
-            logging.info("Send worker shutting down...")
-            break
-        except Exception as e:
-            logging.error(f"Unexpected error in send worker: {e}")
-            await asyncio.sleep(5)  # Longer pause on unexpected errors
+
+async def process_messages_batch(client, batch: List[Tuple[str, Optional[Message], str]]) -> int:
+    """
+    Send a batch of locked messages from fetch_send_batch
+    Returns the number of messages that were due and processed
+    """
+    processed = 0
+    for i, (msg_id, msg, token) in enumerate(batch):
+        try:
+            if not msg:
+                logging.warning(f"Message {msg_id} not found in Redis after lock acquisition")
+                await release_lock(client, _lock_key(msg_id), token)
+                processed += 1
+            elif await process_send_message(client, msg, token):
+                processed += 1
+        except BaseException:
+            # Cancelled part way, e.g. on shutdown; the current message is only
+            # handed back if it has not gone out yet
+            unsent = msg and msg.state in (MessageState.QUEUED, MessageState.SENDING)
+            await abandon_send_batch(client, batch[i:] if unsent else batch[i + 1:])
+            raise
+    return processed
+
+
+async def abandon_send_batch(client, batch: List[Tuple[str, Optional[Message], str]]):
+    """
+    Put fetched messages that were not sent back on the send queue and release their locks
+    """
+    now = time.time()
+    requeue = {msg_id: send_score(msg.priority, msg.retry_after or now, now)
+               for msg_id, msg, _ in batch if msg}
+    if requeue:
+        await client.zadd(SEND_QUEUE, requeue)
+    for token in {token for _, _, token in batch}:
+        await release_locks(client, [msg_id for msg_id, _, t in batch if t == token], token)
+    logging.info(f"Returned {len(requeue)} unsent messages to the send queue")
 
 
 async def fallback_worker(msg: Message):
@@ -307,125 +864,165 @@ async def fallback_worker(msg: Message):
     try:
         client = await redis_client.get_client()
 
-        if not msg.fallback_channels:
-            msg.state = MessageState.FAILED
-            await update_message(msg)
-            logging.info(f"Message {msg.id} failed - no fallback channels available")
+        # Single-flight: only one caller may reroute a message at a time
+        lock_key = FALLBACK_LOCK_PREFIX + msg.id.encode()
+        token = await acquire_lock(client, lock_key, ttl=FALLBACK_LOCK_TTL)
+        if not token:
+            logging.info(f"Message {msg.id} is already being rerouted, skipping fallback")
             return
 
-        # Switch to next fallback channel
-        msg.channel = msg.fallback_channels.pop(0)
-        msg.attempts = 0
+        try:
+            # Switch to next fallback channel
+            channel = await client.lpop(_fallbacks_key(msg.id))
+            if channel is None:
+                msg.state = MessageState.FAILED
+                await update_message(msg)
+                logging.warning(f"Message {msg.id} failed after all attempts and fallbacks")
+                return
 
-        if transition(msg, "reroute"):
-            # Update in Redis
-            await update_message(msg)
+            msg.channel = channel.decode()
+            msg.attempts = 0
+            if msg.fallback_channels:
+                # Keep a copy loaded with with_fallbacks in step with Redis
+                msg.fallback_channels.popleft()
 
-            # Add back to send queue
-            await client.lpush("queue:send", msg.id)
-            logging.info(f"Message {msg.id} falling back to channel: {msg.channel}")
+            if transition(msg, "reroute"):
+                # Update in Redis
+                await update_message(msg)
+
+                # Add back to send queue
+                await requeue_message(client, msg)
+                logging.info(f"Message {msg.id} falling back to channel: {msg.channel}")
+        finally:
+            await release_lock(client, lock_key, token)
     except Exception as e:
         logging.error(f"Error in fallback_worker for message {msg.id}: {e}")
 
 
-async def confirm_worker():
+async def dequeue_confirm_batch(client, count: int = CONFIRM_BATCH_SIZE) -> List[str]:
     """
-    Worker to check for delivery confirmations
+    Pop up to `count` message ids from the confirm queue in a single round-trip
     """
-    logging.info("Confirmation worker started")
+    popped = await client.rpop(CONFIRM_QUEUE, count)
+    return [msg_id.decode() for msg_id in popped or []]
 
-    while True:
-        try:
-            client = await redis_client.get_client()
 
-            # Get messages from confirmation queue
-            result = await client.brpop("queue:confirm", timeout=5)
-
-            if not result:
-                continue
-
-            _, msg_id = result
+async def check_receipts(msgs: List[Message]) -> List[object]:
+    """
+    Check the delivery receipts of several messages concurrently
+    Returns per message the result of receipt_seen, or the exception it raised;
+    a check still running after RECEIPT_TIMEOUT seconds gives TimeoutError
+    """
+    return await asyncio.gather(
+        *(asyncio.wait_for(asyncio.to_thread(receipt_seen, msg), timeout=RECEIPT_TIMEOUT) for msg in msgs),
+        return_exceptions=True
+    )
 
-            # Acquire lock
-            lock_key = f"lock:msg:{msg_id}"
-            acquired = await acquire_lock(client, lock_key, ttl=30)
 
-            if not acquired:
-                continue
+async def process_confirm_batch(msg_ids: List[str]) -> int:
+    """
+    Confirm a batch of locked message ids from the confirm queue
+    State updates are buffered (see CoalescedRedis) and sent with the next flush
+    Returns the number of messages marked confirmed
+    """
+    msgs = [msg for msg in await get_messages(msg_ids) if msg]
+    confirmed = 0
+    for msg, seen in zip(msgs, await check_receipts(msgs)):
+        if isinstance(seen, Exception) and not isinstance(seen, asyncio.TimeoutError):
+            logging.error(f"Error processing confirmation for message {msg.id}: {seen}")
+        elif seen is True:
+            if transition(msg, "confirm"):
+                await update_message(msg)
+                confirmed += 1
+                logging.info(f"Message {msg.id} confirmed delivered")
+        else:
+            # Confirmation timeout - optimistically mark as confirmed
+            if transition(msg, "timeout"):
+                await update_message(msg)
+                confirmed += 1
+                logging.info(f"Message {msg.id} marked confirmed (timeout)")
+    return confirmed
 
-            try:
-                msg = await get_message(msg_id)
-
-                if not msg:
-                    continue
-
-                # In a real system, this would check external services for receipts
-                # For now, we'll simulate confirmation after a delay
-                await asyncio.sleep(2)  # Simulate time to receive confirmation
-
-                # Check if confirmation was received
-                # (In real implementation, this would check external systems)
-                from ..models.routing_state_machine import receipt_seen
-                if receipt_seen(msg):
-                    if transition(msg, "confirm"):
-                        await update_message(msg)
-                        logging.info(f"Message {msg_id} confirmed delivered")
-                else:
-                    # Confirmation timeout - optimistically mark as confirmed
-                    if transition(msg, "timeout"):
-                        await update_message(msg)
-                        logging.info(f"Message {msg_id} marked confirmed (timeout)")
 
-            except Exception as e:
-                logging.error(f"Error processing confirmation for message {msg_id}: {e}")
-            finally:
-                await release_lock(client, lock_key)
+async def confirm_messages_batch(client, msg_ids: List[str]) -> bool:
+    """
+    Lock, confirm and unlock a batch of ids popped from the confirm queue
+    Ids locked elsewhere are pushed back to be looked at again later.
+    Returns False if none of the ids could be locked
+    """
+    token = new_lock_token()
+    locked = await acquire_locks(client, msg_ids, token)
+
+    if len(locked) < len(msg_ids):
+        # Still being handled elsewhere, look at these again later
+        skipped = [msg_id for msg_id in msg_ids if msg_id not in set(locked)]
+        await client.lpush(CONFIRM_QUEUE, *skipped)
+        if not locked:
+            return False
 
-        except asyncio.CancelledError:
-            logging.info("Confirm worker cancelled")
-            break
-        except KeyboardInterrupt:
-            logging.info("Confirm worker shutting down...")
-            break
-        except Exception as e:
-            logging.error(f"Unexpected error in confirm worker: {e}")
-            await asyncio.sleep(5)  # Longer pause on unexpected errors
+    try:
+        await process_confirm_batch(locked)
+    finally:
+        # Sends the buffered updates along with the releases
+        await release_locks(client, locked, token)
+    return True
 
 
-async def cleanup_expired_messages():
+async def scheduler(exit_on_empty: bool = False):
     """
-    Periodically clean up expired messages from Redis
+    Single loop serving both the send and the confirm queue
+    Each round takes a batch from each queue without blocking and handles both,
+    then flushes the shared write buffer once. Only after an idle round does it
+    block on the send queue, for up to BRPOP_TIMEOUT seconds. Confirmations need
+    no wake-up: each one is queued by a send, and the loop that sent it runs
+    another non-blocking round right after.
+    With exit_on_empty the loop never blocks and returns once both queues are
+    drained, which keeps tests from waiting on BRPOP_TIMEOUT
     """
-    logging.info("Starting expired message cleanup task")
+    logging.info("Scheduler started")
+
+    client = await redis_client.get_client()
+    writer = redis_client.get_writer()
+    await load_scripts(client)
+    await migrate_legacy_send_queue(client)
+
+    idle = False
+    # Exponent of the jittered wait after a round hit locks held by another worker
+    backoff = 0
 
     while True:
         try:
-            client = await redis_client.get_client()
-
-            # Get all message keys
-            message_keys = await client.keys("msg:*")
-
-            for key in message_keys:
-                data = await client.hgetall(key)
-                if 'expires_at' in data:
-                    from datetime import datetime
-                    try:
-                        expires_at = datetime.fromisoformat(data['expires_at'])
-                        if datetime.now() > expires_at:
-                            # Message has expired, remove it
-                            await client.delete(key)
-                            msg_id = data.get('id', 'unknown')
-                            logging.info(f"Removed expired message {msg_id}")
-                    except ValueError:
-                        # Invalid date format, skip
-                        continue
-
-            # Wait 1 hour before next cleanup
-            await asyncio.sleep(3600)
+            wait = BRPOP_TIMEOUT if idle and not exit_on_empty else None
+            batch, contended = await fetch_send_batch(client, timeout=wait)
+            confirm_ids = await dequeue_confirm_batch(client)
+
+            if batch:
+                await process_messages_batch(client, batch)
+            if confirm_ids and not await confirm_messages_batch(client, confirm_ids):
+                # All of them are locked elsewhere and were pushed back
+                contended += len(confirm_ids)
+            await writer.flush()
+
+            idle = not batch and not confirm_ids
+            if idle and exit_on_empty:
+                break
+
+            if contended:
+                # Spread retries out so workers do not all race for the same locks again
+                await asyncio.sleep(random.uniform(0, min(0.5, 0.025 * 2 ** backoff)))
+                backoff = min(backoff + 1, 5)
+            else:
+                backoff = 0
 
+        except asyncio.CancelledError:
+            logging.info("Scheduler cancelled")
+            break
+        except KeyboardInterrupt:
+            logging.info("Scheduler shutting down...")
+            break
         except Exception as e:
-            logging.error(f"Error in cleanup_expired_messages: {e}")
-            await asyncio.sleep(300)  # Wait 5 minutes before retrying
+            logging.error(f"Unexpected error in scheduler: {e}")
+            await asyncio.sleep(5)  # Longer pause on unexpected errors
 
 
 async def queue_manager():
@@ -434,12 +1031,8 @@ async def queue_manager():
     """
     logging.info("Starting queue manager...")
 
-    # Run all workers concurrently
-    await asyncio.gather(
-        send_worker(),
-        confirm_worker(),
-        cleanup_expired_messages()
-    )
+    # One loop serves both queues over the shared client and write buffer
+    await scheduler()
 
 
 # Example usage
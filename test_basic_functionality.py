@@ -1,9 +1,17 @@
 import asyncio
+import gc
+import weakref
 import pytest
+from datetime import datetime, timedelta
 from unittest.mock import AsyncMock, MagicMock
-from server.models.routing_state_machine import Message, MessageState, transition, send_worker
-from server.utils.contact_manager import Contact, ChannelPreference
+from server.models.routing_state_machine import (
+    Message, MessageState, transition, send_worker, fallback, retry_delay, state_name, parse_state,
+    RETRY_BASE_DELAY, RETRY_MAX_DELAY, HUMAN_DELAY_MAX, SendError, InvalidChannel, classify_error, send_via_channel
+)
+from server.utils import contact_manager
+from server.utils.contact_manager import Contact, ChannelPreference, ContactManager
 from server.llm import draft_message, ChannelType
+from server.workers import redis_workers
 
 
 def test_message_state_transitions():
@@ -28,8 +36,57 @@ def test_message_state_transitions():
     # Transition to SENT
     transition(msg, "success")
     assert msg.state == MessageState.SENT
-    
-    print("✓ Message state transitions work correctly")
+
+
+def test_message_state_serialization():
+    """Test that states round-trip through their serialized names"""
+    for state in MessageState:
+        assert parse_state(state_name(state)) is state
+
+    assert state_name(MessageState.QUEUED) == "queued"
+    assert f"{MessageState.SENT}" == "sent"
+
+    with pytest.raises(ValueError):
+        parse_state("bogus")
+
+
+def test_fallback_channels_in_order():
+    """Test that fallback walks the fallback channels in order"""
+    msg = Message(id="test", to="+1234567890", text="Test message")
+    msg.fallback_channels.extend(["email", "sms"])
+
+    msg.state = MessageState.FALLBACK
+    assert fallback(msg)
+    assert msg.channel == "email"
+    assert msg.state == MessageState.QUEUED
+
+    msg.state = MessageState.FALLBACK
+    assert fallback(msg)
+    assert msg.channel == "sms"
+
+    assert not fallback(msg)
+    assert msg.state == MessageState.FAILED
+
+
+def test_retry_delay_backoff():
+    """Test that retry delays grow exponentially, are jittered and capped"""
+    for attempts in range(1, 5):
+        base = RETRY_BASE_DELAY * 2 ** (attempts - 1)
+        assert base * 0.5 <= retry_delay(attempts) <= base * 1.5
+
+    assert retry_delay(50) <= RETRY_MAX_DELAY * 1.5
+
+
+def test_send_error_codes():
+    """Test that send failures are classified into error codes"""
+    msg = Message(id="test", to="+1234567890", text="Test message", channel="pigeon")
+
+    with pytest.raises(InvalidChannel) as exc_info:
+        send_via_channel(msg)
+
+    assert classify_error(exc_info.value) == SendError.INVALID_CHANNEL
+    assert classify_error(TimeoutError("timed out")) == SendError.NETWORK_TIMEOUT
+    assert classify_error(RuntimeError("boom")) == SendError.UNKNOWN
 
 
 def test_draft_message_sms():
@@ -40,8 +97,6 @@ def test_draft_message_sms():
     # SMS should be shortened if too long
     assert len(drafted) <= 160
     assert "3pm" in drafted
-    
-    print("✓ SMS message drafting works correctly")
 
 
 def test_draft_message_email():
@@ -55,8 +110,6 @@ def test_draft_message_email():
     assert "Dear John Doe" in drafted
     assert "Acme Corp" in drafted
     assert "Meeting reminder" in drafted
-    
-    print("✓ Email message drafting works correctly")
 
 
 def test_contact_creation():
@@ -74,8 +127,92 @@ def test_contact_creation():
     assert contact.phone == "+1234567890"
     assert contact.imessage_capable is True
     assert contact.preferred_channel == ChannelPreference.RCS
-    
-    print("✓ Contact creation works correctly")
+
+
+def test_contact_manager_roundtrip():
+    """Test storing and retrieving contacts through the contact manager"""
+    manager = ContactManager(":memory:")
+    try:
+        contact = Contact(
+            id="test_contact",
+            name="Test User",
+            phone="+1234567890",
+            email="test@example.com",
+            rcs_capable=True,
+            tags=["customer"]
+        )
+
+        assert manager.add_contact(contact)
+        assert not manager.add_contact(contact)  # Duplicate id
+
+        retrieved = manager.get_contact_by_phone("+1234567890")
+        assert retrieved is not None
+        assert retrieved.name == "Test User"
+        assert retrieved.rcs_capable is True
+        assert retrieved.tags == ["customer"]
+        assert isinstance(retrieved.created_at, datetime)
+
+        assert manager.get_contact_by_email("test@example.com").id == "test_contact"
+
+        assert manager.get_contact_by_identifier("+1234567890").id == "test_contact"
+        assert manager.get_contact_by_identifier("test@example.com").id == "test_contact"
+
+        hint = manager.get_channel_hint_by_identifier("test@example.com")
+        assert hint.id == "test_contact"
+        assert hint.opt_in is True and hint.blocked is False
+        assert manager.get_preferred_channel(hint) == ChannelPreference.RCS
+        assert manager.get_channel_hint_by_identifier("+10000000000") is None
+        assert manager.get_contact_stats()["total_contacts"] == 1
+        assert [c.id for c in manager.get_all_contacts()] == ["test_contact"]
+
+        # Substring search over name, phone and email (short queries included)
+        assert [c.id for c in manager.search_contacts("est Us")] == ["test_contact"]
+        assert [c.id for c in manager.search_contacts("4567")] == ["test_contact"]
+        assert [c.id for c in manager.search_contacts("ex")] == ["test_contact"]
+        assert manager.search_contacts("nobody") == []
+
+        # Bulk insert is all-or-nothing
+        batch = [Contact(id=f"bulk{i}", name=f"Bulk {i}", phone=f"+1555000{i}") for i in range(3)]
+        assert manager.add_contacts(batch) == 3
+        assert manager.add_contacts([Contact(id="bulk9", name="New"), batch[0]]) == 0
+        assert manager.get_contact_by_id("bulk9") is None
+        assert manager.get_contact_stats()["total_contacts"] == 4
+
+        # Upsert inserts new contacts and overwrites existing ones in place
+        assert manager.upsert_contact(Contact(id="bulk9", name="New"))
+        batch[0].name = "Renamed"
+        assert manager.upsert_contact(batch[0])
+        assert manager.get_contact_by_id("bulk0").name == "Renamed"
+        assert manager.get_contact_stats()["total_contacts"] == 5
+    finally:
+        manager.close()
+
+
+def test_contact_iterators_release_connection(monkeypatch):
+    """Test that streaming contacts leaves the pool free for calls made while iterating"""
+    monkeypatch.setattr(contact_manager, "ITER_CHUNK_SIZE", 2)
+    manager = ContactManager(":memory:", pool_size=1)
+    try:
+        assert manager.add_contacts([Contact(id=f"c{i}", name=f"Contact {i}") for i in range(5)]) == 5
+
+        seen = [manager.get_contact_by_id(c.id).id for c in manager.iter_all_contacts()]
+        assert seen == [f"c{i}" for i in range(5)]
+        assert [c.id for c in manager.iter_all_contacts(limit=3, offset=1)] == ["c1", "c2", "c3"]
+
+        found = [manager.get_contact_by_id(c.id).id for c in manager.iter_search_contacts("Contact")]
+        assert sorted(found) == [f"c{i}" for i in range(5)]
+        assert len(manager.search_contacts("Contact", limit=3)) == 3
+    finally:
+        manager.close()
+
+
+def test_contact_manager_collectable():
+    """Test that the background optimize timer does not keep a manager alive"""
+    manager = ContactManager(":memory:")
+    ref = weakref.ref(manager)
+    del manager
+    gc.collect()
+    assert ref() is None
 
 
 def test_message_object_creation():
@@ -91,15 +228,240 @@ def test_message_object_creation():
     assert msg.text == "Test message content"
     assert msg.state == MessageState.DRAFTED
     assert msg.attempts == 0
-    
-    print("✓ Message object creation works correctly")
 
 
-if __name__ == "__main__":
-    test_message_state_transitions()
-    test_draft_message_sms()
-    test_draft_message_email()
-    test_contact_creation()
-    test_message_object_creation()
-    
-    print("\n🎉 All tests passed!")
\ No newline at end of file
+
+def test_send_batch_fits_lock_ttl():
+    """Test that a fetched send batch is processed before its locks expire"""
+    assert redis_workers.DEQUEUE_BATCH_SIZE >= 1
+    assert redis_workers.DEQUEUE_BATCH_SIZE * HUMAN_DELAY_MAX < redis_workers.SEND_LOCK_TTL
+
+
+@pytest.mark.asyncio
+async def test_enqueue_get_message_roundtrip(fake_redis):
+    """Test that enqueued messages load back from Redis"""
+    msg_id = await redis_workers.enqueue_message(
+        "+1234567890", "Test message", "imessage", ["sms", "email"], priority=2
+    )
+
+    msg = await redis_workers.get_message(msg_id)
+    assert msg.id == msg_id
+    assert msg.to == "+1234567890"
+    assert msg.text == "Test message"
+    assert msg.channel == "imessage"
+    assert msg.state == MessageState.QUEUED
+    assert msg.attempts == 0
+    assert not msg.fallback_channels  # Only loaded on request
+    assert msg.priority == 2
+    assert isinstance(msg.created_at, float)
+
+    assert await redis_workers.get_message("missing") is None
+    assert [m and m.id for m in await redis_workers.get_messages([msg_id, "missing"])] == [msg_id, None]
+    assert await fake_redis.ttl(redis_workers._msg_key(msg_id)) > 0
+    assert await fake_redis.ttl(redis_workers._fallbacks_key(msg_id)) > 0
+
+    msg = await redis_workers.get_message(msg_id, with_fallbacks=True)
+    assert list(msg.fallback_channels) == ["sms", "email"]
+
+    # State updates replace the packed state and keep its expiry
+    msg.state = MessageState.SENDING
+    msg.attempts = 1
+    msg.channel = "sms"
+    msg.last_error_code = SendError.NETWORK_TIMEOUT
+    await redis_workers.update_message(msg)
+    await redis_workers.redis_client.get_writer().flush()
+
+    updated = await redis_workers.get_message(msg_id)
+    assert updated.state == MessageState.SENDING
+    assert updated.attempts == 1
+    assert updated.channel == "sms"
+    assert updated.last_error_code == SendError.NETWORK_TIMEOUT
+    assert updated.sent_at is None
+    assert await fake_redis.ttl(redis_workers._state_key(msg_id)) > 0
+
+
+@pytest.mark.asyncio
+async def test_scheduler_backs_off_contended_confirms(fake_redis, monkeypatch):
+    """Test that confirm ids locked elsewhere are pushed back without a busy loop"""
+    rounds = 0
+    dequeue = redis_workers.dequeue_confirm_batch
+
+    async def counting_dequeue(client):
+        nonlocal rounds
+        rounds += 1
+        return await dequeue(client)
+
+    monkeypatch.setattr(redis_workers, "dequeue_confirm_batch", counting_dequeue)
+    await fake_redis.lpush(redis_workers.CONFIRM_QUEUE, "held")
+    await fake_redis.set(redis_workers._lock_key("held"), "other-token")
+
+    task = asyncio.create_task(redis_workers.scheduler(exit_on_empty=True))
+    await asyncio.sleep(0.5)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+    assert 0 < rounds < 20
+    assert await fake_redis.lrange(redis_workers.CONFIRM_QUEUE, 0, -1) == [b"held"]
+    assert await fake_redis.get(redis_workers._lock_key("held")) == b"other-token"
+
+
+@pytest.mark.asyncio
+async def test_scheduler_drains_queues(fake_redis, monkeypatch):
+    """Test that the scheduler alone takes messages from queued to confirmed"""
+    monkeypatch.setattr(redis_workers, "human_delay_seconds", lambda: 0)
+
+    msg_ids = [await redis_workers.enqueue_message(f"+155500000{i}", "Test message", "sms") for i in range(3)]
+    await redis_workers.scheduler(exit_on_empty=True)
+
+    for msg in await redis_workers.get_messages(msg_ids):
+        assert msg.state == MessageState.CONFIRMED
+        assert msg.confirmed_at is not None
+    assert await fake_redis.zcard(redis_workers.SEND_QUEUE) == 0
+    assert await fake_redis.llen(redis_workers.CONFIRM_QUEUE) == 0
+    assert await fake_redis.keys(b"lock:*") == []
+
+
+@pytest.mark.asyncio
+async def test_legacy_send_list_migrated(fake_redis):
+    """Test that live ids in the old send list move onto the send queue in order"""
+    future = (datetime.now() + timedelta(hours=1)).isoformat()
+    past = (datetime.now() - timedelta(hours=1)).isoformat()
+    for msg_id, expires_at in (("a", future), ("old", past), ("b", None), ("gone", None), ("c", future)):
+        if msg_id != "gone":
+            fields = {"id": msg_id, "to": "+1234567890", "text": "Test message", "channel": "sms", "state": "queued"}
+            if expires_at:
+                fields["expires_at"] = expires_at
+            await fake_redis.hset(f"msg:{msg_id}", mapping=fields)
+        await fake_redis.lpush(redis_workers.LEGACY_SEND_QUEUE, msg_id)
+
+    assert await redis_workers.migrate_legacy_send_queue(fake_redis) == 3
+    assert await redis_workers.migrate_legacy_send_queue(fake_redis) == 0
+    assert await fake_redis.zrange(redis_workers.SEND_QUEUE, 0, -1) == [b"a", b"b", b"c"]
+    assert not await fake_redis.exists(redis_workers.LEGACY_SEND_QUEUE)
+
+    # Legacy hashes now expire, and expired messages are dropped
+    assert 0 < await fake_redis.ttl("msg:a") <= 3600
+    assert 0 < await fake_redis.ttl("msg:b") <= redis_workers.MESSAGE_TTL
+    assert not await fake_redis.exists("msg:old")
+
+
+@pytest.mark.asyncio
+async def test_legacy_message_hash_loads(fake_redis):
+    """Test that hashes written before the packed state still load their state"""
+    await fake_redis.hset("msg:old", mapping={
+        "id": "old", "to": "+1234567890", "text": "Test message", "channel": "sms",
+        "state": "sent", "attempts": 2, "created_at": "2024-01-01T12:00:00", "sent_at": "1700000000.5"
+    })
+    await fake_redis.hset("msg:bare", mapping={"id": "bare", "to": "+1234567890", "text": "Test message"})
+
+    old, bare = await redis_workers.get_messages(["old", "bare"])
+    assert old.state == MessageState.SENT
+    assert old.attempts == 2
+    assert old.sent_at == 1700000000.5
+    assert isinstance(old.created_at, float)
+    assert bare.state == MessageState.QUEUED
+
+
+@pytest.mark.asyncio
+async def test_failed_sends_retry_then_fall_back(fake_redis, monkeypatch):
+    """Test that failing channels are retried, then each fallback is tried in order"""
+    attempted = []
+
+    def flaky_send(msg):
+        attempted.append(msg.channel)
+        if msg.channel != "rcs":
+            raise TimeoutError("timed out")
+
+    monkeypatch.setattr(redis_workers, "human_delay_seconds", lambda: 0)
+    monkeypatch.setattr(redis_workers, "retry_delay", lambda attempts: 0)
+    monkeypatch.setattr(redis_workers, "send_via_channel", flaky_send)
+
+    msg_id = await redis_workers.enqueue_message("+1234567890", "Test message", "sms", ["email", "rcs"])
+    await redis_workers.scheduler(exit_on_empty=True)
+
+    assert attempted == ["sms"] * 3 + ["email"] * 3 + ["rcs"]
+    msg = await redis_workers.get_message(msg_id, with_fallbacks=True)
+    assert msg.state == MessageState.CONFIRMED
+    assert msg.channel == "rcs"
+    assert msg.last_error_code == SendError.NETWORK_TIMEOUT
+    assert not msg.fallback_channels
+    assert await fake_redis.llen(redis_workers.CONFIRM_QUEUE) == 0
+    assert await fake_redis.keys(b"*lock*") == []
+
+
+@pytest.mark.asyncio
+async def test_fallback_and_lock_release_respect_holders(fake_redis):
+    """Test the fallback single-flight lock and token-checked lock release"""
+    msg_id = await redis_workers.enqueue_message("+1234567890", "Test message", "sms", ["email"])
+    msg = await redis_workers.get_message(msg_id)
+    msg.state = MessageState.FALLBACK
+
+    # Another caller is already rerouting this message
+    fallback_key = redis_workers.FALLBACK_LOCK_PREFIX + msg_id.encode()
+    token = await redis_workers.acquire_lock(fake_redis, fallback_key)
+    await redis_workers.fallback_worker(msg)
+    assert msg.channel == "sms"
+    assert await fake_redis.lrange(redis_workers._fallbacks_key(msg_id), 0, -1) == [b"email"]
+
+    # Only the holder's token releases a lock
+    await redis_workers.release_lock(fake_redis, fallback_key, "not-the-token")
+    assert await fake_redis.get(fallback_key) == token.encode()
+    await redis_workers.release_lock(fake_redis, fallback_key, token)
+    assert not await fake_redis.exists(fallback_key)
+
+    await redis_workers.fallback_worker(msg)
+    assert msg.channel == "email"
+    assert msg.state == MessageState.QUEUED
+    assert not await fake_redis.exists(redis_workers._fallbacks_key(msg_id))
+
+
+@pytest.mark.asyncio
+async def test_cancelled_batch_returns_unsent_messages(fake_redis, monkeypatch):
+    """Test that cancelling the scheduler mid-batch leaves no message stranded"""
+    monkeypatch.setattr(redis_workers, "human_delay_seconds", lambda: 0.05)
+    msg_ids = [await redis_workers.enqueue_message(f"+155500000{i}", "Test message", "sms") for i in range(10)]
+
+    task = asyncio.create_task(redis_workers.scheduler(exit_on_empty=True))
+    await asyncio.sleep(0.17)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+    queued = {msg_id.decode() for msg_id in await fake_redis.zrange(redis_workers.SEND_QUEUE, 0, -1)}
+    sent = {msg.id for msg in await redis_workers.get_messages(msg_ids) if msg.state in (MessageState.SENT, MessageState.CONFIRMED)}
+    assert queued and sent
+    assert queued | sent == set(msg_ids)
+    assert await fake_redis.keys(b"lock:*") == []
+
+    await redis_workers.scheduler(exit_on_empty=True)
+    for msg in await redis_workers.get_messages(msg_ids):
+        assert msg.state == MessageState.CONFIRMED
+
+
+@pytest.mark.asyncio
+async def test_legacy_message_retries_then_falls_back(fake_redis, monkeypatch):
+    """Test that a migrated legacy message still walks its comma-joined fallbacks"""
+    attempted = []
+
+    def flaky_send(msg):
+        attempted.append(msg.channel)
+        if msg.channel == "sms":
+            raise TimeoutError("timed out")
+
+    monkeypatch.setattr(redis_workers, "human_delay_seconds", lambda: 0)
+    monkeypatch.setattr(redis_workers, "retry_delay", lambda attempts: 0)
+    monkeypatch.setattr(redis_workers, "send_via_channel", flaky_send)
+
+    await fake_redis.hset("msg:old", mapping={
+        "id": "old", "to": "+1234567890", "text": "Test message", "channel": "sms",
+        "state": "queued", "attempts": 0, "fallback_channels": "email,rcs"
+    })
+    await fake_redis.lpush(redis_workers.LEGACY_SEND_QUEUE, "old")
+
+    await redis_workers.scheduler(exit_on_empty=True)
+
+    assert attempted == ["sms"] * 3 + ["email"]
+    msg = await redis_workers.get_message("old", with_fallbacks=True)
+    assert msg.state == MessageState.CONFIRMED
+    assert msg.channel == "email"
+    assert list(msg.fallback_channels) == ["rcs"]
+    assert await fake_redis.ttl(redis_workers._fallbacks_key("old")) > 0